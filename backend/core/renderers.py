@@ -0,0 +1,35 @@
+"""
+Renderer JSON de la API basado en orjson.
+
+orjson es opcional: si no está instalado se usa el JSONRenderer de DRF.
+"""
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer de DRF que codifica con orjson.
+    Las fechas y los tipos que orjson no conoce (Decimal, textos traducibles,
+    etc.) pasan por el encoder de DRF para que la salida sea la misma.
+    """
+
+    _encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Sin orjson, o con indentación solicitada, se usa el renderer estándar
+        if (orjson is None or data is None or
+                self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return orjson.dumps(
+            data,
+            default=self._encoder.default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
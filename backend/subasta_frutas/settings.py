@@ -103,6 +103,11 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # Respuestas JSON codificadas con orjson (usa el de DRF si no está instalado)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     # Paginación automática para listados
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,  # 20 registros por página
@@ -217,6 +222,24 @@ CHANNEL_LAYERS = {
 #         },
 #     },
 # }
+
+# =============================================================================
+# CACHÉ (configuración de subastas y reportes Excel ya generados)
+# =============================================================================
+# Para desarrollo usamos memoria local (una caché por proceso)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Para producción con Redis, compartida entre procesos (descomentar y configurar):
+# CACHES = {
+#     "default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": "redis://127.0.0.1:6379/1",
+#     },
+# }
 # =============================================================================
 # CONFIGURACIÓN DE CORREO (SMTP)
 # =============================================================================
@@ -204,7 +204,7 @@ class SubastaDetalleConsumer(AsyncJsonWebsocketConsumer):
         # Enviar estado actual de la subasta
         await self.send_json({
             "tipo": "conexion_establecida",
-            "subasta_id": int(self.subasta_id),
+            "subasta_id": self.subasta_id,
             "subasta": subasta,
             "autenticado": not isinstance(user, AnonymousUser)
         })
@@ -279,7 +279,7 @@ class SubastaDetalleConsumer(AsyncJsonWebsocketConsumer):
         """La subasta terminó."""
         await self.send_json({
             "tipo": "subasta_finalizada",
-            "subasta_id": int(self.subasta_id),
+            "subasta_id": self.subasta_id,
             "ganador": event.get("ganador"),
             "monto_final": event.get("monto_final"),
             "total_pujas": event.get("total_pujas", 0)
@@ -289,7 +289,7 @@ class SubastaDetalleConsumer(AsyncJsonWebsocketConsumer):
         """La subasta fue cancelada."""
         await self.send_json({
             "tipo": "subasta_cancelada",
-            "subasta_id": int(self.subasta_id),
+            "subasta_id": self.subasta_id,
             "mensaje": event.get("mensaje", "La subasta ha sido cancelada")
         })
     
@@ -306,10 +306,7 @@ class SubastaDetalleConsumer(AsyncJsonWebsocketConsumer):
         from .models import Subasta
         
         try:
-            subasta = Subasta.objects.select_related(
-                'packing_detalle__packing_tipo__packing_semanal__empresa',
-                'packing_detalle__packing_tipo__tipo_fruta'
-            ).get(pk=self.subasta_id)
+            subasta = Subasta.objects.con_packing().get(pk=self.subasta_id)
             
             return {
                 "id": subasta.id,
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:04
+
+from django.db import migrations, models
+
+
+def dejar_una_ganadora(apps, schema_editor):
+    """Antes de crear el índice, deja solo la oferta más alta marcada como ganadora."""
+    Oferta = apps.get_model('subastas', 'Oferta')
+
+    subastas_duplicadas = (
+        Oferta.objects.filter(es_ganadora=True)
+        .values('subasta_id')
+        .annotate(total=models.Count('id'))
+        .filter(total__gt=1)
+        .values_list('subasta_id', flat=True)
+    )
+    for subasta_id in list(subastas_duplicadas):
+        ganadora = (
+            Oferta.objects.filter(subasta_id=subasta_id)
+            .order_by('-monto', '-fecha_oferta')
+            .first()
+        )
+        Oferta.objects.filter(subasta_id=subasta_id, es_ganadora=True).exclude(
+            pk=ganadora.pk
+        ).update(es_ganadora=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0005_alter_cliente_creado_por'),
+        ('subastas', '0005_add_kilos_solicitados_to_oferta'),
+    ]
+
+    operations = [
+        migrations.RunPython(dejar_una_ganadora, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='oferta',
+            constraint=models.UniqueConstraint(condition=models.Q(('es_ganadora', True)), fields=('subasta',), name='uniq_winner_per_subasta'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modulo_packing', '0004_packingimagen'),
+        ('subastas', '0006_oferta_uniq_winner_per_subasta'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subasta',
+            index=models.Index(fields=['estado', 'fecha_hora_fin'], name='idx_subasta_estado_fin'),
+        ),
+        migrations.AddIndex(
+            model_name='subasta',
+            index=models.Index(fields=['estado', 'fecha_hora_inicio'], name='idx_subasta_estado_inicio'),
+        ),
+    ]
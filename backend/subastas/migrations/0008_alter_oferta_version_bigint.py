@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subastas', '0007_subasta_indices_estado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='oferta',
+            name='version',
+            field=models.BigIntegerField(default=1, verbose_name='Versión (control de concurrencia)'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-16 21:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def calcular_precio_vigente(apps, schema_editor):
+    """Rellena precio_vigente y oferta_lider con la oferta más alta de cada subasta."""
+    Subasta = apps.get_model('subastas', 'Subasta')
+    Oferta = apps.get_model('subastas', 'Oferta')
+
+    ofertas_subasta = Oferta.objects.filter(
+        subasta_id=models.OuterRef('pk')
+    ).order_by('-monto', '-fecha_oferta')
+    Subasta.objects.update(
+        precio_vigente=models.Subquery(ofertas_subasta.values('monto')[:1]),
+        oferta_lider=models.Subquery(ofertas_subasta.values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subastas', '0008_alter_oferta_version_bigint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subasta',
+            name='oferta_lider',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='subastas.oferta', verbose_name='Oferta líder'),
+        ),
+        migrations.AddField(
+            model_name='subasta',
+            name='precio_vigente',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Oferta más alta vigente'),
+        ),
+        migrations.RunPython(calcular_precio_vigente, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-16 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0005_alter_cliente_creado_por'),
+        ('subastas', '0010_subasta_precio_vigente'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='oferta',
+            name='subastas_of_subasta_9a8b11_idx',
+        ),
+        migrations.AddIndex(
+            model_name='oferta',
+            index=models.Index(fields=['subasta', '-monto', '-fecha_oferta'], name='subastas_of_subasta_f38440_idx'),
+        ),
+    ]
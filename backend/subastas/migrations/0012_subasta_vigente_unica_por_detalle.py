@@ -0,0 +1,72 @@
+# Generated by Django 6.0.1 on 2026-10-16 22:05
+
+from django.db import migrations, models
+
+
+def dejar_una_vigente(apps, schema_editor):
+    """
+    Antes de crear el índice, deja una sola subasta no cancelada por detalle.
+    
+    Solo se cancelan automáticamente las subastas PROGRAMADA sin ofertas: se
+    conserva la que ya tiene resultados (ACTIVA, FINALIZADA o con ofertas) o,
+    si ninguna los tiene, la más reciente (la misma que get_subasta_reemplazo
+    muestra como reemplazo). Si un detalle tiene más de una subasta con
+    resultados, la migración se detiene y lista sus ids para que un operador
+    decida cuál cancelar.
+    """
+    Subasta = apps.get_model('subastas', 'Subasta')
+
+    detalles_duplicados = (
+        Subasta.objects.exclude(estado='CANCELADA')
+        .values('packing_detalle_id')
+        .annotate(total=models.Count('id'))
+        .filter(total__gt=1)
+        .values_list('packing_detalle_id', flat=True)
+    )
+    conflictos = {}
+    for packing_detalle_id in list(detalles_duplicados):
+        subastas = list(
+            Subasta.objects.filter(packing_detalle_id=packing_detalle_id)
+            .exclude(estado='CANCELADA')
+            .annotate(num_ofertas=models.Count('ofertas'))
+            .order_by('-fecha_creacion', '-id')
+        )
+        con_resultados = [
+            subasta for subasta in subastas
+            if subasta.estado != 'PROGRAMADA' or subasta.num_ofertas
+        ]
+        if len(con_resultados) > 1:
+            conflictos[packing_detalle_id] = [subasta.pk for subasta in con_resultados]
+            continue
+
+        vigente = con_resultados[0] if con_resultados else subastas[0]
+        Subasta.objects.filter(
+            pk__in=[subasta.pk for subasta in subastas if subasta.pk != vigente.pk]
+        ).update(estado='CANCELADA')
+
+    if conflictos:
+        detalle = '; '.join(
+            f'packing_detalle {packing_detalle_id}: subastas {ids}'
+            for packing_detalle_id, ids in sorted(conflictos.items())
+        )
+        raise RuntimeError(
+            'RF-01: hay producciones diarias con más de una subasta no cancelada '
+            'con ofertas o ya iniciada. Cancele manualmente las que sobran y '
+            f'vuelva a ejecutar la migración ({detalle}).'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modulo_packing', '0004_packingimagen'),
+        ('subastas', '0011_oferta_indice_subasta_monto_fecha'),
+    ]
+
+    operations = [
+        migrations.RunPython(dejar_una_vigente, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subasta',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'CANCELADA'), _negated=True), fields=('packing_detalle',), name='uniq_subasta_vigente_por_detalle', violation_error_message='Ya existe Subasta con este Producción Diaria.'),
+        ),
+    ]
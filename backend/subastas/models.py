@@ -6,11 +6,154 @@ Estructura:
 2. Oferta - Pujas de los clientes en las subastas
 """
 
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, CharField, Count, F, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.functions import Now
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 
+# Ofertas que se incrustan en el detalle de una subasta; el historial completo
+# se consulta en /historial_ofertas/
+OFERTAS_DETALLE_MAX = 50
+
+
+class ConcurrencyError(Exception):
+    """
+    RN-03: La oferta fue modificada por otra transacción desde que se leyó.
+    Las vistas la traducen a una respuesta 409 (Conflict).
+    """
+
+
+def a_monto(monto):
+    """
+    Normaliza un monto en soles a Decimal con 2 decimales. Los Decimal (los
+    que valida DRF) se devuelven tal cual; float o str (app móvil) se convierten.
+    """
+    if isinstance(monto, Decimal):
+        return monto
+    return Decimal(str(monto)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class SubastaQuerySet(models.QuerySet):
+    """QuerySet con precargas reutilizables por las vistas de subastas."""
+
+    def con_packing(self):
+        """
+        Une en la misma consulta la cadena del packing que leen los serializers
+        (empresa, tipo de fruta, semana y detalle del día) vía las propiedades
+        empresa, tipo_fruta, packing_semanal y kilos_totales.
+        """
+        return self.select_related(
+            'packing_detalle__packing_tipo__tipo_fruta',
+            'packing_detalle__packing_tipo__packing_semanal__empresa',
+        )
+
+    def con_imagenes(self):
+        """
+        Precarga las imágenes de la jerarquía RN-01 en dos consultas en bloque.
+        Las fotos del tipo de fruta quedan en `_imgs_tipo` y las generales del
+        packing semanal en `_imgs_generales`, de modo que get_imagenes()
+        resuelva la prioridad en memoria sin consultar la BD por cada subasta.
+        """
+        from modulo_packing.models import PackingImagen
+
+        return self.prefetch_related(
+            Prefetch(
+                'packing_detalle__packing_tipo__imagenes',
+                to_attr='_imgs_tipo'
+            ),
+            Prefetch(
+                'packing_detalle__packing_tipo__packing_semanal__imagenes',
+                queryset=PackingImagen.objects.filter(packing_tipo__isnull=True),
+                to_attr='_imgs_generales'
+            ),
+        )
+
+    def para_listado(self):
+        """
+        Limita las columnas a las que usan los serializers de listado (admin y
+        app móvil). Se omiten campos de auditoría y textos largos como las
+        observaciones del packing semanal.
+        """
+        return self.only(
+            'id',
+            'packing_detalle',
+            'fecha_hora_inicio',
+            'fecha_hora_fin',
+            'precio_base',
+            'precio_vigente',
+            'oferta_lider',
+            'estado',
+            'extensiones_realizadas',
+            'fecha_creacion',
+            'packing_detalle__fecha',
+            'packing_detalle__dia',
+            'packing_detalle__py',
+            'packing_detalle__packing_tipo__tipo_fruta__nombre',
+            'packing_detalle__packing_tipo__packing_semanal__empresa__nombre',
+        )
+
+    def con_ganadora(self):
+        """
+        Une en la misma consulta la oferta líder desnormalizada (`oferta_lider`)
+        y su cliente, en lugar de precargar las ofertas de cada subasta.
+        """
+        return self.select_related('oferta_lider__cliente')
+
+    def con_ofertas_de(self, cliente):
+        """
+        Precarga en `_mis_ofertas` las ofertas del cliente en cada subasta, de
+        mayor a menor monto (participación del usuario en la app móvil).
+        """
+        return self.prefetch_related(
+            Prefetch(
+                'ofertas',
+                queryset=Oferta.objects.filter(cliente_id=cliente.id).order_by('-monto'),
+                to_attr='_mis_ofertas'
+            )
+        )
+
+    def con_ofertas_detalle(self, limite=OFERTAS_DETALLE_MAX):
+        """
+        Precarga en `_ofertas_detalle` las `limite` mejores ofertas de cada
+        subasta (orden por defecto de Oferta) con su cliente.
+        """
+        return self.prefetch_related(
+            Prefetch(
+                'ofertas',
+                queryset=Oferta.objects.select_related('cliente')[:limite],
+                to_attr='_ofertas_detalle'
+            )
+        )
+
+    def con_total_ofertas(self):
+        """
+        Anota `num_ofertas` con el conteo de ofertas de cada subasta, resuelto
+        en la misma consulta del listado.
+        """
+        return self.annotate(num_ofertas=Count('ofertas'))
+
+    def con_estado(self, ahora=None):
+        """
+        Anota `estado_real` con el mismo cálculo que estado_calculado, resuelto
+        en SQL. Pensado para listados: la propiedad usa la anotación si existe.
+        """
+        ahora = ahora or Now()
+        return self.annotate(
+            estado_real=Case(
+                When(estado='CANCELADA', then=Value('CANCELADA')),
+                When(fecha_hora_inicio__gt=ahora, then=Value('PROGRAMADA')),
+                When(fecha_hora_fin__gte=ahora, then=Value('ACTIVA')),
+                default=Value('FINALIZADA'),
+                output_field=CharField(),
+            )
+        )
+
+
 class Subasta(models.Model):
     """
     Subasta asociada a una producción diaria (PackingDetalle).
@@ -63,6 +206,27 @@ class Subasta(models.Model):
         verbose_name="Extensiones de tiempo realizadas"
     )
 
+    # Precio y oferta líder desnormalizados (los mantienen Oferta.save y la
+    # señal post_delete de Oferta)
+    # para leer el precio actual sin consultar las ofertas
+    precio_vigente = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Oferta más alta vigente"
+    )
+    oferta_lider = models.ForeignKey(
+        'Oferta',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        verbose_name="Oferta líder"
+    )
+
     # Campos de auditoría
     fecha_creacion = models.DateTimeField(
         auto_now_add=True,
@@ -72,11 +236,27 @@ class Subasta(models.Model):
         auto_now=True,
         verbose_name="Fecha de actualización"
     )
+
+    objects = SubastaQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Subasta"
         verbose_name_plural = "Subastas"
         ordering = ['-fecha_hora_inicio']
+        # Índices para los barridos del scheduler y actualizar_estados
+        indexes = [
+            models.Index(fields=['estado', 'fecha_hora_fin'], name='idx_subasta_estado_fin'),
+            models.Index(fields=['estado', 'fecha_hora_inicio'], name='idx_subasta_estado_inicio'),
+        ]
+        constraints = [
+            # RF-01: una sola subasta no cancelada por producción diaria (índice parcial)
+            models.UniqueConstraint(
+                fields=['packing_detalle'],
+                condition=~Q(estado='CANCELADA'),
+                name='uniq_subasta_vigente_por_detalle',
+                violation_error_message='Ya existe Subasta con este Producción Diaria.',
+            ),
+        ]
     
     def __str__(self):
         return f"Subasta #{self.id} - {self.packing_detalle}"
@@ -88,8 +268,11 @@ class Subasta(models.Model):
                 'fecha_hora_fin': 'La fecha de finalización debe ser posterior a la fecha de inicio.'
             })
     
-    def save(self, *args, **kwargs):
-        self.full_clean()
+    def save(self, *args, validate=True, **kwargs):
+        # Las transiciones generadas por el servidor (estado, anti-sniping)
+        # usan validate=False para no pagar full_clean() en cada cambio
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
     
     @property
@@ -98,6 +281,10 @@ class Subasta(models.Model):
         Calcula el estado real basado en las fechas.
         Útil para mostrar el estado en tiempo real.
         """
+        # Ya calculado en SQL por SubastaQuerySet.con_estado()
+        if hasattr(self, 'estado_real'):
+            return self.estado_real
+        
         ahora = timezone.now()
         
         if self.estado == 'CANCELADA':
@@ -118,24 +305,42 @@ class Subasta(models.Model):
     @property
     def tiempo_restante_segundos(self):
         """Retorna los segundos restantes para que termine la subasta."""
-        if not self.esta_activa:
+        return self.segundos_restantes()
+    
+    def segundos_restantes(self, ahora=None):
+        """
+        Segundos restantes respecto a `ahora` (por defecto, el reloj actual).
+        Los listados pasan el mismo instante para todas las filas.
+        """
+        # Misma condición que esta_activa, con una sola lectura del reloj
+        ahora = ahora or timezone.now()
+        if (self.estado == 'CANCELADA' or
+                ahora < self.fecha_hora_inicio or ahora > self.fecha_hora_fin):
             return 0
         
-        ahora = timezone.now()
-        diferencia = self.fecha_hora_fin - ahora
-        return max(0, int(diferencia.total_seconds()))
+        return int((self.fecha_hora_fin - ahora).total_seconds())
+    
+    @property
+    def ofertas_detalle(self):
+        """Ofertas que muestra el detalle (acotadas a OFERTAS_DETALLE_MAX)."""
+        # Ya precargadas por SubastaQuerySet.con_ofertas_detalle()
+        if hasattr(self, '_ofertas_detalle'):
+            return self._ofertas_detalle
+        return list(self.ofertas.select_related('cliente')[:OFERTAS_DETALLE_MAX])
     
     @property
     def oferta_ganadora(self):
-        """Retorna la oferta más alta actual."""
-        return self.ofertas.order_by('-monto').first()
+        """Retorna la oferta más alta actual (marcada por Oferta._actualizar_ganadora)."""
+        # Ya unida por SubastaQuerySet.con_ganadora()
+        if Subasta.oferta_lider.is_cached(self):
+            return self.oferta_lider
+        return self.ofertas.filter(es_ganadora=True).first()
     
     @property
     def precio_actual(self):
         """Retorna el precio actual (oferta más alta o precio base)."""
-        oferta = self.oferta_ganadora
-        if oferta:
-            return oferta.monto
+        if self.precio_vigente is not None:
+            return self.precio_vigente
         return self.precio_base
     
     def puede_ofertar(self, monto):
@@ -146,11 +351,32 @@ class Subasta(models.Model):
         if not self.esta_activa:
             return False, "La subasta no está activa."
         
-        if monto <= self.precio_actual:
-            return False, f"El monto debe ser superior a {self.precio_actual}."
+        precio_actual = self.precio_actual
+        if a_monto(monto) <= precio_actual:
+            return False, f"El monto debe ser superior a {precio_actual}."
         
         return True, "OK"
     
+    def reservar_precio(self, monto):
+        """
+        RN-02/RN-03: CAS previo a registrar una puja.
+        Sube precio_vigente a `monto` en un solo UPDATE, solo si la subasta
+        sigue activa y el monto supera el precio actual en la BD. Retorna False
+        si otra puja concurrente tomó el precio primero.
+        """
+        monto = a_monto(monto)
+        ahora = timezone.now()
+        reservada = Subasta.objects.filter(
+            Q(precio_vigente__lt=monto) | Q(precio_vigente__isnull=True, precio_base__lt=monto),
+            pk=self.pk,
+            fecha_hora_inicio__lte=ahora,
+            fecha_hora_fin__gte=ahora,
+        ).exclude(estado='CANCELADA').update(precio_vigente=monto)
+        
+        if reservada:
+            self.precio_vigente = monto
+        return bool(reservada)
+    
     # Métodos para obtener información del packing
     @property
     def empresa(self):
@@ -182,18 +408,23 @@ class Subasta(models.Model):
         packing_tipo = self.packing_detalle.packing_tipo
         packing_semanal = packing_tipo.packing_semanal
         
+        # Si la queryset usó con_imagenes(), resolver la jerarquía en memoria
+        if hasattr(packing_tipo, '_imgs_tipo'):
+            return packing_tipo._imgs_tipo or packing_semanal._imgs_generales or []
+        
         # Prioridad Alta: Imágenes del tipo de fruta
-        imagenes_tipo = packing_tipo.imagenes.all()
-        if imagenes_tipo.exists():
+        # (se materializa en lista: una sola consulta en lugar de exists() + iteración)
+        imagenes_tipo = list(packing_tipo.imagenes.all())
+        if imagenes_tipo:
             return imagenes_tipo
         
         # Prioridad Media: Imágenes generales del packing semanal
-        imagenes_generales = packing_semanal.imagenes.filter(packing_tipo__isnull=True)
-        if imagenes_generales.exists():
+        imagenes_generales = list(packing_semanal.imagenes.filter(packing_tipo__isnull=True))
+        if imagenes_generales:
             return imagenes_generales
         
         # Prioridad Baja: Sin imágenes
-        return packing_tipo.imagenes.none()
+        return []
 
 
 class Oferta(models.Model):
@@ -247,7 +478,7 @@ class Oferta(models.Model):
     )
     
     # Campo para control de concurrencia
-    version = models.PositiveIntegerField(
+    version = models.BigIntegerField(
         default=1,
         verbose_name="Versión (control de concurrencia)"
     )
@@ -258,30 +489,161 @@ class Oferta(models.Model):
         ordering = ['-monto', '-fecha_oferta']
         # Índices para mejorar el rendimiento
         indexes = [
-            models.Index(fields=['subasta', '-monto']),
+            models.Index(fields=['subasta', '-monto', '-fecha_oferta']),
             models.Index(fields=['cliente', '-fecha_oferta']),
         ]
+        constraints = [
+            # A lo sumo una oferta ganadora por subasta (índice parcial)
+            models.UniqueConstraint(
+                fields=['subasta'],
+                condition=Q(es_ganadora=True),
+                name='uniq_winner_per_subasta',
+            ),
+        ]
     
     def __str__(self):
         return f"Oferta de {self.cliente} - ${self.monto} en {self.subasta}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Versión leída de la BD, usada como condición del UPDATE (RN-03).
+        # Si la columna se difirió (only/defer) no se fuerza su carga aquí.
+        if 'version' in field_names:
+            instance._loaded_version = instance.version
+        return instance
+    
     def save(self, *args, **kwargs):
-        # Al guardar, verificar si es la oferta ganadora
-        super().save(*args, **kwargs)
-        self._actualizar_ganadora()
+        es_nueva = self._state.adding
+        if es_nueva:
+            super().save(*args, **kwargs)
+        else:
+            self._guardar_con_version(kwargs.get('update_fields'))
+        self._loaded_version = self.version
+        
+        if es_nueva:
+            self._registrar_como_lider()
+        else:
+            # Al editar, verificar cuál es la oferta ganadora y reflejarlo
+            # en la instancia (p. ej. al bajar el monto deja de ganar)
+            self._actualizar_ganadora()
+            self.es_ganadora = Oferta.objects.filter(pk=self.pk).values_list(
+                'es_ganadora', flat=True
+            ).get()
+    
+    def _registrar_como_lider(self):
+        """
+        CAS sobre la subasta: la oferta nueva solo pasa a ser líder si su monto
+        alcanza el precio vigente. Una oferta por debajo del máximo no puede
+        ser ganadora y no toca es_ganadora.
+        """
+        monto = a_monto(self.monto)
+        es_lider = Subasta.objects.filter(
+            Q(precio_vigente__isnull=True) | Q(precio_vigente__lte=monto),
+            pk=self.subasta_id,
+        ).update(precio_vigente=monto, oferta_lider=self)
+        if not es_lider:
+            self.es_ganadora = False
+            return
+        
+        try:
+            with transaction.atomic():
+                Oferta.objects.filter(
+                    subasta_id=self.subasta_id, es_ganadora=True
+                ).exclude(pk=self.pk).update(es_ganadora=False)
+                Oferta.objects.filter(pk=self.pk).update(es_ganadora=True)
+        except IntegrityError:
+            raise ConcurrencyError(
+                'Otra oferta se registró al mismo tiempo. Intente nuevamente.'
+            )
+        self.es_ganadora = True
+        
+        # Mantener al día la instancia de subasta en memoria (notificaciones)
+        if Oferta.subasta.is_cached(self):
+            self.subasta.precio_vigente = monto
+            self.subasta.oferta_lider_id = self.pk
+    
+    def _guardar_con_version(self, update_fields=None):
+        """
+        Persiste los campos de la instancia con actualizar_con_version().
+        
+        Es un UPDATE directo: no pasa por Model.save(), así que al editar una
+        oferta existente no se envían las señales pre_save ni post_save.
+        """
+        if update_fields is None:
+            # es_ganadora lo mantiene _actualizar_ganadora()
+            update_fields = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('version', 'es_ganadora', 'fecha_oferta')
+            ]
+        self.actualizar_con_version(**{
+            self._meta.get_field(nombre).attname: getattr(self, self._meta.get_field(nombre).attname)
+            for nombre in update_fields if nombre != 'version'
+        })
+    
+    def actualizar_con_version(self, **campos):
+        """
+        RN-03: Optimistic locking. Toda actualización de una oferta pasa por aquí.
+        
+        Ejecuta UPDATE ... SET version = version + 1 WHERE pk=<pk> AND version=<leída>.
+        Si no afecta filas, otra transacción modificó la oferta primero y se
+        lanza ConcurrencyError.
+        """
+        version_esperada = getattr(self, '_loaded_version', self.version)
+        filas = type(self).objects.filter(pk=self.pk, version=version_esperada).update(
+            version=F('version') + 1,
+            **campos
+        )
+        if filas == 0:
+            raise ConcurrencyError(
+                'La oferta fue modificada por otra operación. Recargue e intente nuevamente.'
+            )
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        self.version = self._loaded_version = version_esperada + 1
     
     def _actualizar_ganadora(self):
-        """Marca esta oferta como ganadora si es la más alta."""
-        # Desmarcar todas las ofertas ganadoras de esta subasta
-        Oferta.objects.filter(subasta=self.subasta, es_ganadora=True).exclude(
-            id=self.id
-        ).update(es_ganadora=False)
+        """Marca como ganadora la oferta más alta de esta subasta."""
+        Oferta.marcar_ganadoras([self.subasta_id])
+    
+    @classmethod
+    def marcar_ganadoras(cls, subasta_ids):
+        """
+        Marca como ganadora la oferta más alta (empates por fecha) de cada
+        subasta indicada y recalcula su precio vigente, con tres UPDATE en
+        total sin importar el tamaño del lote.
         
-        # Verificar si esta es la oferta más alta
-        oferta_maxima = self.subasta.ofertas.order_by('-monto').first()
-        if oferta_maxima and oferta_maxima.id == self.id:
-            if not self.es_ganadora:
-                Oferta.objects.filter(id=self.id).update(es_ganadora=True)
+        El índice único `uniq_winner_per_subasta` garantiza una sola ganadora,
+        por eso primero se desmarcan las anteriores y luego se marcan las nuevas.
+        Si otra transacción ganó la carrera, la BD rechaza el UPDATE y se
+        lanza ConcurrencyError.
+        """
+        ganadora_id = Subquery(
+            cls.objects.filter(subasta_id=OuterRef('subasta_id'))
+            .order_by('-monto', '-fecha_oferta')
+            .values('pk')[:1]
+        )
+        ofertas = cls.objects.filter(subasta_id__in=subasta_ids)
+        ofertas_subasta = cls.objects.filter(
+            subasta_id=OuterRef('pk')
+        ).order_by('-monto', '-fecha_oferta')
+        try:
+            with transaction.atomic():
+                ofertas.filter(es_ganadora=True).exclude(
+                    pk=ganadora_id
+                ).update(es_ganadora=False)
+                
+                ofertas.filter(es_ganadora=False, pk=ganadora_id).update(es_ganadora=True)
+                
+                # Recalcular los campos desnormalizados de las subastas
+                Subasta.objects.filter(pk__in=subasta_ids).update(
+                    precio_vigente=Subquery(ofertas_subasta.values('monto')[:1]),
+                    oferta_lider=Subquery(ofertas_subasta.values('pk')[:1]),
+                )
+        except IntegrityError:
+            raise ConcurrencyError(
+                'Otra oferta se registró al mismo tiempo. Intente nuevamente.'
+            )
 
 
 class ConfiguracionSubasta(models.Model):
@@ -319,13 +681,24 @@ class ConfiguracionSubasta(models.Model):
     def __str__(self):
         return "Configuración Global de Subastas"
 
+    CACHE_KEY = 'subastas:config'
+    CACHE_TTL = 60  # segundos
+
     def save(self, *args, **kwargs):
         """Garantiza que solo exista un registro (singleton)."""
         self.pk = 1
         super().save(*args, **kwargs)
+        # Los cambios del panel se aplican de inmediato
+        cache.delete(self.CACHE_KEY)
 
     @classmethod
     def get(cls):
-        """Obtiene (o crea con defaults) la configuración global."""
-        obj, _ = cls.objects.get_or_create(pk=1)
+        """
+        Obtiene (o crea con defaults) la configuración global.
+        Se lee en cada puja (anti-sniping), por eso se cachea CACHE_TTL segundos.
+        """
+        obj = cache.get(cls.CACHE_KEY)
+        if obj is None:
+            obj, _ = cls.objects.get_or_create(pk=1)
+            cache.set(cls.CACHE_KEY, obj, cls.CACHE_TTL)
         return obj
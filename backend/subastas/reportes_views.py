@@ -9,19 +9,258 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.http import HttpResponse
-from django.db.models import Count, Max, Min
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.db.models import Count, F, Max, Min, Prefetch, Q, Sum
 from django.utils import timezone
 from usuarios.permissions import RBACPermission
+from channels.db import database_sync_to_async
+from collections import namedtuple
+from functools import wraps
+from hashlib import md5
 from datetime import datetime
-import pytz
+from io import BytesIO
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from zoneinfo import ZoneInfo
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell.cell import Cell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 
 from .models import Subasta, Oferta
 from clientes.models import Cliente
-from modulo_packing.models import PackingSemanal, PackingDetalle
+from modulo_packing.models import PackingSemanal, PackingTipo, PackingDetalle
+
+
+# Filas leídas de la BD por bloque al recorrer los querysets de los reportes
+REPORTE_CHUNK_SIZE = 500
+
+# Tamaño hasta el que el .xlsx generado se mantiene en memoria antes de pasar a disco
+REPORTE_MAX_MEMORIA = 10 * 1024 * 1024
+
+# Segundos que se reutiliza un reporte ya generado con la misma huella (ETag)
+REPORTE_CACHE_TTL = 15 * 60
+
+# Zona horaria de Perú (America/Lima, UTC-5) para los horarios del reporte
+LIMA_TZ = ZoneInfo('America/Lima')
+
+# Estados de subasta que cuentan como terminada en el reporte de packing
+ESTADOS_TERMINADOS = frozenset({'FINALIZADA', 'CANCELADA'})
+
+# Días de la semana (columnas Lunes a Sábado del reporte de packing)
+DIAS_SEMANA = ('LUNES', 'MARTES', 'MIERCOLES', 'JUEVES', 'VIERNES', 'SABADO')
+
+# Etiquetas de las opciones impresas en los reportes (equivalentes a los
+# get_FOO_display(), que reconstruyen el dict de choices en cada llamada)
+_DIA_DISPLAY = dict(PackingDetalle.DIA_CHOICES)
+_TIPO_CLIENTE_DISPLAY = dict(Cliente.TIPO_CHOICES)
+_ESTADO_CLIENTE_DISPLAY = dict(Cliente.ESTADO_CHOICES)
+_ESTATUS_FICHA_DISPLAY = dict(Cliente.ESTATUS_FICHA_CHOICES)
+_ESTADO_PACKING_DISPLAY = dict(PackingSemanal.ESTADO_CHOICES)
+
+# Columnas de una oferta que usa el ranking del reporte de subastas
+_OfertaRanking = namedtuple('OfertaRanking', ['cliente_id', 'cliente_nombre', 'monto', 'kilos_solicitados'])
+
+
+def _formato_fecha(fecha):
+    """dd/mm/yyyy, equivalente a strftime('%d/%m/%Y') pero más rápido por fila."""
+    return f"{fecha.day:02d}/{fecha.month:02d}/{fecha.year}"
+
+
+def _formato_fecha_hora(fecha_hora):
+    """dd/mm/yyyy HH:MM, equivalente a strftime('%d/%m/%Y %H:%M')."""
+    return (
+        f"{fecha_hora.day:02d}/{fecha_hora.month:02d}/{fecha_hora.year} "
+        f"{fecha_hora.hour:02d}:{fecha_hora.minute:02d}"
+    )
+
+
+def _adjunto_excel(archivo, filename):
+    """Envía en streaming un .xlsx ya generado como archivo adjunto."""
+    # FileResponse cierra el archivo al terminar la respuesta
+    return FileResponse(
+        archivo,
+        as_attachment=True,
+        filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
+def _respuesta_excel(wb, filename, clave_cache=None):
+    """
+    Guarda el workbook en un archivo temporal (en memoria hasta
+    REPORTE_MAX_MEMORIA, luego en disco) y lo envía en streaming como adjunto,
+    en lugar de acumular todo el .xlsx en el cuerpo de un HttpResponse.
+    
+    Con `clave_cache`, los bytes generados se guardan además en la caché
+    durante REPORTE_CACHE_TTL segundos (solo si el archivo no pasó a disco).
+    """
+    archivo = SpooledTemporaryFile(max_size=REPORTE_MAX_MEMORIA)
+    wb.save(archivo)
+    if clave_cache and archivo.tell() <= REPORTE_MAX_MEMORIA:
+        archivo.seek(0)
+        cache.set(clave_cache, archivo.read(), REPORTE_CACHE_TTL)
+    archivo.seek(0)
+    return _adjunto_excel(archivo, filename)
+
+
+def _etag_reporte_subastas(subastas, ahora):
+    """
+    ETag del reporte de subastas: huella de todo lo que imprime el reporte para
+    las subastas del rango, calculada en una sola consulta agregada.
+    
+    Cubre cambios en las subastas (fecha_actualizacion), en sus ofertas (altas,
+    bajas y ediciones vía version), en los clientes, en los datos del packing
+    que se imprimen (empresa, tipo de fruta, semana, día, fecha y kilos),
+    además de las transiciones de estado por tiempo (cuántas subastas aún no
+    inician y cuántas ya terminaron respecto a `ahora`).
+    """
+    huella = subastas.order_by().aggregate(
+        total=Count('id', distinct=True),
+        actualizada=Max('fecha_actualizacion'),
+        programadas=Count('id', filter=Q(fecha_hora_inicio__gt=ahora), distinct=True),
+        terminadas=Count('id', filter=Q(fecha_hora_fin__lt=ahora), distinct=True),
+        num_ofertas=Count('ofertas', distinct=True),
+        versiones=Sum('ofertas__version'),
+        montos=Sum('ofertas__monto'),
+        cliente_actualizado=Max('ofertas__cliente__fecha_actualizacion'),
+        semanas=Max('packing_detalle__packing_tipo__packing_semanal__fecha_actualizacion'),
+    )
+    # Empresa, tipo de fruta y el detalle del día no tienen fecha de
+    # actualización: se toman los valores impresos, una fila por detalle y sin
+    # el join de ofertas que los repetiría
+    huella['packing'] = list(
+        subastas.order_by('packing_detalle_id').values_list(
+            'packing_detalle_id',
+            'packing_detalle__py',
+            'packing_detalle__dia',
+            'packing_detalle__fecha',
+            'packing_detalle__packing_tipo__tipo_fruta__nombre',
+            'packing_detalle__packing_tipo__packing_semanal__empresa__nombre',
+            'packing_detalle__packing_tipo__packing_semanal__fecha_inicio_semana',
+            'packing_detalle__packing_tipo__packing_semanal__fecha_fin_semana',
+        ).distinct()
+    )
+    return '"%s"' % md5(repr(sorted(huella.items())).encode()).hexdigest()
+
+
+def _por_bloques(iterable, tamano):
+    """Agrupa un iterable en listas de hasta `tamano` elementos."""
+    iterador = iter(iterable)
+    while bloque := list(islice(iterador, tamano)):
+        yield bloque
+
+
+def _ofertas_por_subasta(subasta_ids):
+    """
+    Lee en una sola consulta las ofertas de las subastas indicadas y las agrupa
+    por subasta, ordenadas de mayor a menor monto (desempate por la más reciente).
+    """
+    ofertas = {}
+    filas = Oferta.objects.filter(subasta_id__in=subasta_ids).order_by(
+        'subasta_id', '-monto', '-fecha_oferta'
+    ).values_list('subasta_id', 'cliente_id', 'cliente__nombre_razon_social', 'monto', 'kilos_solicitados')
+    for subasta_id, *columnas in filas:
+        ofertas.setdefault(subasta_id, []).append(_OfertaRanking(*columnas))
+    return ofertas
+
+
+# =============================================================================
+# ESTILOS COMPARTIDOS
+# =============================================================================
+# Se definen una sola vez al importar el módulo. Cada workbook los registra como
+# estilos con nombre y los resuelve una sola vez; las celdas reciben el estilo ya
+# resuelto, en lugar de asignar font/fill/alignment/border por cada celda.
+
+def _relleno(color):
+    return PatternFill(start_color=color, end_color=color, fill_type='solid')
+
+
+_BORDE_CELDA = Border(
+    left=Side(style='thin', color='D3D3D3'),
+    right=Side(style='thin', color='D3D3D3'),
+    top=Side(style='thin', color='D3D3D3'),
+    bottom=Side(style='thin', color='D3D3D3')
+)
+_FUENTE_TITULO = Font(name='Calibri', size=16, bold=True, color='FFFFFF')
+_FUENTE_ENCABEZADO = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
+_FUENTE_CELDA = Font(name='Calibri', size=10)
+_ALINEACION_TITULO = Alignment(horizontal='center', vertical='center')
+_ALINEACION_ENCABEZADO = Alignment(horizontal='center', vertical='center', wrap_text=True)
+_ALINEACION_CELDA = Alignment(horizontal='left', vertical='center')
+_FORMATO_NUMERO = '#,##0.00'
+
+ESTILOS_REPORTE = {
+    'titulo': dict(font=_FUENTE_TITULO, fill=_relleno('1F4788'), alignment=_ALINEACION_TITULO),
+    'titulo_packing': dict(font=_FUENTE_TITULO, fill=_relleno('E46C0A'), alignment=_ALINEACION_TITULO),
+    'encabezado': dict(font=_FUENTE_ENCABEZADO, fill=_relleno('4472C4'),
+                       alignment=_ALINEACION_ENCABEZADO, border=_BORDE_CELDA),
+    'encabezado_packing': dict(font=_FUENTE_ENCABEZADO, fill=_relleno('ED7D31'),
+                               alignment=_ALINEACION_ENCABEZADO, border=_BORDE_CELDA),
+    'encabezado_ranking': dict(font=_FUENTE_ENCABEZADO, fill=_relleno('70AD47'),
+                               alignment=_ALINEACION_ENCABEZADO, border=_BORDE_CELDA),
+    'celda': dict(font=_FUENTE_CELDA, alignment=_ALINEACION_CELDA, border=_BORDE_CELDA),
+    'celda_numero': dict(font=_FUENTE_CELDA, alignment=_ALINEACION_CELDA, border=_BORDE_CELDA,
+                         number_format=_FORMATO_NUMERO),
+    # Día de packing con historial de subastas pero ninguna vigente (solo canceladas)
+    'celda_numero_cancelada': dict(font=_FUENTE_CELDA, fill=_relleno('FCE4D6'), alignment=_ALINEACION_CELDA,
+                                   border=_BORDE_CELDA, number_format=_FORMATO_NUMERO),
+}
+
+
+def _crear_workbook(titulo_hoja):
+    """
+    Crea un workbook en modo write_only (las filas se escriben en streaming
+    y no se mantienen en memoria) con los estilos del reporte registrados.
+    
+    Retorna (wb, ws, estilos), donde `estilos` mapea cada nombre de
+    ESTILOS_REPORTE a su estilo ya resuelto en este workbook.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo_hoja)
+    estilos = {}
+    for nombre, atributos in ESTILOS_REPORTE.items():
+        estilo = NamedStyle(name=nombre, **atributos)
+        wb.add_named_style(estilo)
+        estilos[nombre] = estilo.as_tuple()
+    return wb, ws, estilos
+
+
+def _fila(ws, valores, estilos):
+    """
+    Construye una fila de celdas write_only; `estilos` es un estilo resuelto
+    (ver _crear_workbook) o una lista con uno por columna.
+    
+    Asignar cell.style = 'nombre' busca el estilo en el workbook en cada celda;
+    pasar el estilo resuelto al constructor evita esa búsqueda.
+    """
+    if not isinstance(estilos, list):
+        estilos = [estilos] * len(valores)
+    return [
+        Cell(ws, row=1, column=1, value=valor, style_array=estilo)
+        for valor, estilo in zip(valores, estilos)
+    ]
+
+
+def _ajustar_dimensiones(ws, column_widths):
+    """
+    Fija los anchos de columna y la altura de las filas de título y encabezados.
+    En modo write_only las dimensiones deben definirse antes de escribir filas.
+    """
+    for col_letter, width in column_widths.items():
+        ws.column_dimensions[col_letter].width = width
+    
+    ws.row_dimensions[1].height = 30
+    ws.row_dimensions[2].height = 35
+
+
+def _escribir_titulo(ws, titulo, estilo, ultima_columna):
+    """Escribe la fila de título y la combina hasta `ultima_columna`."""
+    ws.append(_fila(ws, [titulo], estilo))
+    ws.merged_cells.add(f'A1:{ultima_columna}1')
 
 
 class ReporteSubastasViewSet(viewsets.ViewSet):
@@ -41,6 +280,25 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         'packing_excel': 'generate_packings',
     }
     
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        """
+        Expone las acciones como vistas async que generan el reporte en un hilo
+        del pool (thread_sensitive=False).
+        
+        Bajo ASGI (Daphne) Django ejecuta todas las vistas síncronas en un único
+        hilo compartido, por lo que un reporte de varios segundos bloquearía al
+        resto de peticiones HTTP. database_sync_to_async cierra además las
+        conexiones a la BD que el hilo deje abiertas.
+        """
+        vista = super().as_view(actions, **initkwargs)
+        
+        @wraps(vista)
+        async def vista_async(request, *args, **kwargs):
+            return await database_sync_to_async(vista, thread_sensitive=False)(request, *args, **kwargs)
+        
+        return vista_async
+    
     def _formato_semana(self, fecha_inicio, fecha_fin):
         """
         Formatea el rango de fechas al formato:
@@ -49,7 +307,7 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         """
         semana = fecha_inicio.isocalendar()[1]
         
-        return f"Semana {semana} | {fecha_inicio.strftime('%d/%m/%Y')} - {fecha_fin.strftime('%d/%m/%Y')}"
+        return f"Semana {semana} | {_formato_fecha(fecha_inicio)} - {_formato_fecha(fecha_fin)}"
     
     @action(detail=False, methods=['get'])
     def excel(self, request):
@@ -73,24 +331,13 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Construir queryset base con todas las relaciones necesarias
-        queryset = Subasta.objects.select_related(
-            'packing_detalle',
-            'packing_detalle__packing_tipo',
-            'packing_detalle__packing_tipo__tipo_fruta',
-            'packing_detalle__packing_tipo__packing_semanal',
-            'packing_detalle__packing_tipo__packing_semanal__empresa',
-        ).prefetch_related('ofertas', 'ofertas__cliente').order_by(
-            '-packing_detalle__packing_tipo__packing_semanal__fecha_inicio_semana',  # Semana descendente (más recientes primero)
-            'packing_detalle__fecha',  # Día ascendente (Lunes → Sábado)
-            'packing_detalle__packing_tipo__tipo_fruta__nombre'  # Tipo de fruta alfabéticamente
-        )
+        subastas = Subasta.objects.all()
         
         # Aplicar filtros de fecha si se proporcionan
         if fecha_inicio_str:
             try:
                 fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
-                queryset = queryset.filter(fecha_hora_inicio__date__gte=fecha_inicio)
+                subastas = subastas.filter(fecha_hora_inicio__date__gte=fecha_inicio)
             except ValueError:
                 return Response(
                     {'error': 'Formato de fecha_inicio inválido. Use YYYY-MM-DD'},
@@ -100,49 +347,111 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         if fecha_fin_str:
             try:
                 fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
-                queryset = queryset.filter(fecha_hora_inicio__date__lte=fecha_fin)
+                subastas = subastas.filter(fecha_hora_inicio__date__lte=fecha_fin)
             except ValueError:
                 return Response(
                     {'error': 'Formato de fecha_fin inválido. Use YYYY-MM-DD'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
-        # Generar el archivo Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Subastas"
+        # Obtener tiempo actual
+        ahora = timezone.now()
+        
+        # Caché HTTP: si nada de lo que imprime el reporte cambió desde la última
+        # descarga del cliente, se responde 304 sin volver a generar el archivo
+        etag = _etag_reporte_subastas(subastas, ahora)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        # Crear nombre de archivo con timestamp (el mismo instante del reporte)
+        timestamp = ahora.strftime('%Y%m%d_%H%M%S')
+        filename = f"reporte_subastas_{timestamp}.xlsx"
+        
+        # Otro usuario (o el mismo desde otro navegador) ya generó el reporte con
+        # la misma huella: se reutilizan los bytes sin consultar ni armar el Excel.
+        # La clave depende del ETag, que cubre todas las columnas impresas (un
+        # cambio de nombre de empresa o tipo de fruta genera otra clave); el
+        # prefijo v2 descarta lo guardado con la huella anterior, incompleta.
+        # El contenido no depende del usuario, así que la clave no lo incluye.
+        clave_cache = f"rpt:subastas:v2:{fecha_inicio_str}:{fecha_fin_str or ''}:{etag}"
+        contenido = cache.get(clave_cache)
+        if contenido is not None:
+            response = _adjunto_excel(BytesIO(contenido), filename)
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        
+        # Consulta plana con solo las columnas que imprime el reporte: cada fila
+        # es un dict, sin instanciar modelos ni recorrer relaciones en Python
+        queryset = subastas.con_estado(ahora).annotate(
+            total_ofertas=Count('ofertas')
+        ).values(
+            'id', 'estado_real', 'fecha_hora_inicio', 'fecha_hora_fin', 'precio_base', 'total_ofertas',
+            empresa=F('packing_detalle__packing_tipo__packing_semanal__empresa__nombre'),
+            semana_id=F('packing_detalle__packing_tipo__packing_semanal_id'),
+            semana_inicio=F('packing_detalle__packing_tipo__packing_semanal__fecha_inicio_semana'),
+            semana_fin=F('packing_detalle__packing_tipo__packing_semanal__fecha_fin_semana'),
+            dia=F('packing_detalle__dia'),
+            fecha=F('packing_detalle__fecha'),
+            tipo_fruta=F('packing_detalle__packing_tipo__tipo_fruta__nombre'),
+            kilos=F('packing_detalle__py'),
+        ).order_by(
+            '-packing_detalle__packing_tipo__packing_semanal__fecha_inicio_semana',  # Semana descendente (más recientes primero)
+            'packing_detalle__fecha',  # Día ascendente (Lunes → Sábado)
+            'packing_detalle__packing_tipo__tipo_fruta__nombre'  # Tipo de fruta alfabéticamente
+        )
+        
+        # Generar el archivo Excel (modo streaming)
+        wb, ws, estilos = _crear_workbook("Reporte de Subastas")
         
         # =====================================================================
-        # ESTILOS
+        # AJUSTAR ANCHOS DE COLUMNAS
         # =====================================================================
+        column_widths = {
+            'A': 12,  # ID Subasta
+            'B': 25,  # Empresa
+            'C': 35,  # Semana (Aumentado para mostrar "Semana X | dd/mm/yyyy...")
+            'D': 12,  # Día
+            'E': 18,  # Fecha Producción
+            'F': 20,  # Tipo Fruta
+            'G': 12,  # Kilos
+            'H': 15,  # Estado
+            'I': 18,  # Fecha Inicio
+            'J': 18,  # Fecha Fin
+            'K': 12,  # Duración
+            'L': 14,  # Precio Base
+            'M': 28,  # Cliente Rank 1
+            'N': 14,  # Monto Rank 1
+            'O': 16,  # Kg Solicitados 1
+            'P': 16,  # Importe Total 1
+            'Q': 28,  # Cliente Rank 2
+            'R': 14,  # Monto Rank 2
+            'S': 16,  # Kg Solicitados 2
+            'T': 16,  # Importe Total 2
+            'U': 28,  # Cliente Rank 3
+            'V': 14,  # Monto Rank 3
+            'W': 16,  # Kg Solicitados 3
+            'X': 16,  # Importe Total 3
+            'Y': 28,  # Cliente Rank 4
+            'Z': 14,  # Monto Rank 4
+            'AA': 16, # Kg Solicitados 4
+            'AB': 16, # Importe Total 4
+            'AC': 28, # Cliente Rank 5
+            'AD': 14, # Monto Rank 5
+            'AE': 16, # Kg Solicitados 5
+            'AF': 16, # Importe Total 5
+            'AG': 14, # Total Ofertas
+        }
         
-        # Estilo del título
-        titulo_font = Font(name='Calibri', size=16, bold=True, color='FFFFFF')
-        titulo_fill = PatternFill(start_color='1F4788', end_color='1F4788', fill_type='solid')
-        titulo_alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Estilo del encabezado de columnas
-        header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        # Estilo de las celdas de datos
-        cell_font = Font(name='Calibri', size=10)
-        cell_alignment = Alignment(horizontal='left', vertical='center')
-        cell_border = Border(
-            left=Side(style='thin', color='D3D3D3'),
-            right=Side(style='thin', color='D3D3D3'),
-            top=Side(style='thin', color='D3D3D3'),
-            bottom=Side(style='thin', color='D3D3D3')
-        )
+        _ajustar_dimensiones(ws, column_widths)
         
         # =====================================================================
         # TÍTULO DEL REPORTE
         # =====================================================================
         
-        ws.merge_cells('A1:AG1')
-        cell_titulo = ws['A1']
-        
         # Crear texto del título con rango de fechas
         titulo_texto = "REPORTE DE SUBASTAS"
         if fecha_inicio_str or fecha_fin_str:
@@ -153,11 +462,7 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             else:
                 titulo_texto += f" - Hasta {fecha_fin_str}"
         
-        cell_titulo.value = titulo_texto
-        cell_titulo.font = titulo_font
-        cell_titulo.fill = titulo_fill
-        cell_titulo.alignment = titulo_alignment
-        ws.row_dimensions[1].height = 30
+        _escribir_titulo(ws, titulo_texto, estilos['titulo'], 'AG')
         
         # =====================================================================
         # ENCABEZADOS DE COLUMNAS
@@ -199,231 +504,169 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             'Total Ofertas'
         ]
         
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=2, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            
-            # COLORES DIFERENCIADOS PARA CABECERAS
+        # COLORES DIFERENCIADOS PARA CABECERAS
+        estilos_headers = []
+        for col_num in range(1, len(headers) + 1):
             # Datos de Packing (Cols 2-7): Naranja
             if 2 <= col_num <= 7:
-                cell.fill = PatternFill(start_color='ED7D31', end_color='ED7D31', fill_type='solid')
-            # Datos de Subasta (Cols 8-12): Azul
-            elif 8 <= col_num <= 12:
-                cell.fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
+                estilos_headers.append(estilos['encabezado_packing'])
             # Ranking (Cols 13-32): Verde
             elif 13 <= col_num <= 32:
-                cell.fill = PatternFill(start_color='70AD47', end_color='70AD47', fill_type='solid')
-            # Total Ofertas (Col 33): Azul
-            elif col_num == 33:
-                cell.fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
+                estilos_headers.append(estilos['encabezado_ranking'])
+            # ID Subasta, Datos de Subasta (Cols 8-12) y Total Ofertas (Col 33): Azul
             else:
-                cell.fill = header_fill # Default (ID Subasta)
-            cell.alignment = header_alignment
-            cell.border = cell_border
-        
-        ws.row_dimensions[2].height = 35
+                estilos_headers.append(estilos['encabezado'])
+        
+        ws.append(_fila(ws, headers, estilos_headers))
+        
+        # Formato especial para números:
+        # Kilos (7), Precio Base (12)
+        # Montos de Ranking (14, 18, 22, 26, 30)
+        # Kg Solicitados (15, 19, 23, 27, 31)
+        # Importes Totales (16, 20, 24, 28, 32)
+        columnas_numericas = {7, 12, 14, 15, 16, 18, 19, 20, 22, 23, 24, 26, 27, 28, 30, 31, 32}
+        estilos_datos = [
+            estilos['celda_numero'] if col_num in columnas_numericas else estilos['celda']
+            for col_num in range(1, len(headers) + 1)
+        ]
         
         # =====================================================================
         # DATOS DE SUBASTAS
         # =====================================================================
         
-        # Obtener tiempo actual
-        ahora = timezone.now()
+        # Etiqueta "Semana N | ..." por packing semanal, formateada una sola vez
+        semanas_formateadas = {}
         
         row_num = 3
-        for subasta in queryset:
-            # 1. Calcular estado en tiempo real (Lógica dinámica)
-            estado_real = subasta.estado
-            if subasta.estado != 'CANCELADA':
-                if ahora < subasta.fecha_hora_inicio:
-                    estado_real = 'PROGRAMADA'
-                elif subasta.fecha_hora_inicio <= ahora <= subasta.fecha_hora_fin:
-                    estado_real = 'ACTIVA'
-                else:
-                    estado_real = 'FINALIZADA'
-
-            # 2. Obtener el ranking de los 5 mejores clientes únicos (Optimizado en memoria)
-            # Usamos las ofertas ya pre-cargadas en subasta.ofertas.all()
-            ofertas = list(subasta.ofertas.all())
-            # Ordenar ofertas por monto de mayor a menor
-            ofertas_ordenadas = sorted(ofertas, key=lambda o: o.monto, reverse=True)
-            
-            # Obtener clientes únicos con su mejor oferta (top 5)
-            clientes_vistos = set()
-            top_5_clientes = []
-            for oferta in ofertas_ordenadas:
-                if oferta.cliente.id not in clientes_vistos:
-                    clientes_vistos.add(oferta.cliente.id)
-                    top_5_clientes.append(oferta)
-                    if len(top_5_clientes) >= 5:
-                        break
+        # Las subastas se recorren por bloques para no cargar todo el reporte en
+        # memoria; las ofertas de cada bloque se leen en una sola consulta
+        for bloque in _por_bloques(queryset.iterator(chunk_size=REPORTE_CHUNK_SIZE), REPORTE_CHUNK_SIZE):
+            ofertas_por_subasta = _ofertas_por_subasta([subasta['id'] for subasta in bloque])
             
-            # 3. Preparar datos del ranking en columnas separadas
-            ranking_clientes = []
-            ranking_montos = []
-            ranking_kilos = []
-            ranking_importes = []
-            
-            if estado_real == 'CANCELADA':
-                # Rellenar con CANCELADA
-                for _ in range(5):
-                    ranking_clientes.append('CANCELADA')
-                    ranking_montos.append(None)
-                    ranking_kilos.append(None)
-                    ranking_importes.append(None)
-            elif estado_real == 'PROGRAMADA':
-                # Rellenar con Pendiente
-                for _ in range(5):
-                    ranking_clientes.append('Pendiente')
-                    ranking_montos.append(None)
-                    ranking_kilos.append(None)
-                    ranking_importes.append(None)
-            elif len(top_5_clientes) == 0:
-                # Rellenar con Sin ofertas
-                for _ in range(5):
-                    ranking_clientes.append('Sin ofertas')
-                    ranking_montos.append(None)
-                    ranking_kilos.append(None)
-                    ranking_importes.append(None)
-            else:
-                # Llenar con datos reales y completar hasta 5
-                for i in range(5):
-                    if i < len(top_5_clientes):
-                        oferta = top_5_clientes[i]
-                        ranking_clientes.append(oferta.cliente.nombre_razon_social)
-                        ranking_montos.append(float(oferta.monto))
-                        # Kg solicitados (puede ser null)
-                        kg = float(oferta.kilos_solicitados) if oferta.kilos_solicitados else None
-                        ranking_kilos.append(kg)
-                        # Importe total = monto × kg solicitados
-                        if kg:
-                            ranking_importes.append(float(oferta.monto) * kg)
-                        else:
-                            ranking_importes.append(None)
-                    else:
-                        ranking_clientes.append('')
+            for subasta in bloque:
+                # 1. Estado en tiempo real (calculado en SQL con el mismo `ahora`)
+                estado_real = subasta['estado_real']
+                
+                # 2. Obtener el ranking de los 5 mejores clientes únicos (Optimizado en memoria)
+                # Las ofertas del bloque ya vienen ordenadas por monto de mayor a menor
+                ofertas_ordenadas = ofertas_por_subasta.get(subasta['id'], [])
+                
+                # Obtener clientes únicos con su mejor oferta (top 5)
+                clientes_vistos = set()
+                top_5_clientes = []
+                for oferta in ofertas_ordenadas:
+                    if oferta.cliente_id not in clientes_vistos:
+                        clientes_vistos.add(oferta.cliente_id)
+                        top_5_clientes.append(oferta)
+                        if len(top_5_clientes) >= 5:
+                            break
+                
+                # 3. Preparar datos del ranking en columnas separadas
+                ranking_clientes = []
+                ranking_montos = []
+                ranking_kilos = []
+                ranking_importes = []
+                
+                if estado_real == 'CANCELADA':
+                    # Rellenar con CANCELADA
+                    for _ in range(5):
+                        ranking_clientes.append('CANCELADA')
                         ranking_montos.append(None)
                         ranking_kilos.append(None)
                         ranking_importes.append(None)
-            
-            # Contar ofertas totales
-            total_ofertas = subasta.ofertas.count()
-            
-            # Obtener datos del packing
-            detalle = subasta.packing_detalle
-            packing_tipo = detalle.packing_tipo
-            packing_semanal = packing_tipo.packing_semanal
-            
-            # Convertir horarios UTC a zona horaria de Perú (America/Lima, UTC-5)
-            lima_tz = pytz.timezone('America/Lima')
-            fecha_inicio_peru = subasta.fecha_hora_inicio.astimezone(lima_tz)
-            fecha_fin_peru = subasta.fecha_hora_fin.astimezone(lima_tz)
-            
-            # Calcular duración de la subasta
-            duracion_delta = subasta.fecha_hora_fin - subasta.fecha_hora_inicio
-            duracion_segundos = int(duracion_delta.total_seconds())
-            duracion_horas = duracion_segundos // 3600
-            duracion_minutos = (duracion_segundos % 3600) // 60
-            duracion_str = f"{duracion_horas}h {duracion_minutos}m"
-            
-            # Datos de la fila
-            row_data = [
-                subasta.id,
-                packing_semanal.empresa.nombre,
-                self._formato_semana(packing_semanal.fecha_inicio_semana, packing_semanal.fecha_fin_semana),
-                detalle.get_dia_display(),
-                detalle.fecha.strftime('%d/%m/%Y'),
-                packing_tipo.tipo_fruta.nombre,
-                float(detalle.py),
-                estado_real, # Usamos el estado calculado en tiempo real
-                fecha_inicio_peru.strftime('%d/%m/%Y %H:%M'),  # Horario de Perú
-                fecha_fin_peru.strftime('%d/%m/%Y %H:%M'),      # Horario de Perú
-                duracion_str,  # Nueva columna de duración
-                float(subasta.precio_base),
-                ranking_clientes[0],  # Cliente Rank 1
-                ranking_montos[0],    # Monto Rank 1
-                ranking_kilos[0],     # Kg Solicitados 1
-                ranking_importes[0],  # Importe Total 1
-                ranking_clientes[1],  # Cliente Rank 2
-                ranking_montos[1],    # Monto Rank 2
-                ranking_kilos[1],     # Kg Solicitados 2
-                ranking_importes[1],  # Importe Total 2
-                ranking_clientes[2],  # Cliente Rank 3
-                ranking_montos[2],    # Monto Rank 3
-                ranking_kilos[2],     # Kg Solicitados 3
-                ranking_importes[2],  # Importe Total 3
-                ranking_clientes[3],  # Cliente Rank 4
-                ranking_montos[3],    # Monto Rank 4
-                ranking_kilos[3],     # Kg Solicitados 4
-                ranking_importes[3],  # Importe Total 4
-                ranking_clientes[4],  # Cliente Rank 5
-                ranking_montos[4],    # Monto Rank 5
-                ranking_kilos[4],     # Kg Solicitados 5
-                ranking_importes[4],  # Importe Total 5
-                total_ofertas
-            ]
-            
-            # Escribir la fila
-            for col_num, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col_num)
-                cell.value = value
-                cell.font = cell_font
-                cell.border = cell_border
-                cell.alignment = cell_alignment
+                elif estado_real == 'PROGRAMADA':
+                    # Rellenar con Pendiente
+                    for _ in range(5):
+                        ranking_clientes.append('Pendiente')
+                        ranking_montos.append(None)
+                        ranking_kilos.append(None)
+                        ranking_importes.append(None)
+                elif len(top_5_clientes) == 0:
+                    # Rellenar con Sin ofertas
+                    for _ in range(5):
+                        ranking_clientes.append('Sin ofertas')
+                        ranking_montos.append(None)
+                        ranking_kilos.append(None)
+                        ranking_importes.append(None)
+                else:
+                    # Llenar con datos reales y completar hasta 5
+                    for i in range(5):
+                        if i < len(top_5_clientes):
+                            oferta = top_5_clientes[i]
+                            ranking_clientes.append(oferta.cliente_nombre)
+                            ranking_montos.append(oferta.monto)
+                            # Kg solicitados (puede ser null)
+                            kg = oferta.kilos_solicitados or None
+                            ranking_kilos.append(kg)
+                            # Importe total = monto × kg solicitados
+                            if kg:
+                                ranking_importes.append(oferta.monto * kg)
+                            else:
+                                ranking_importes.append(None)
+                        else:
+                            ranking_clientes.append('')
+                            ranking_montos.append(None)
+                            ranking_kilos.append(None)
+                            ranking_importes.append(None)
                 
-                # Formato especial para números:
-                # Kilos (7), Precio Base (12)
-                # Montos de Ranking (14, 18, 22, 26, 30)
-                # Kg Solicitados (15, 19, 23, 27, 31)
-                # Importes Totales (16, 20, 24, 28, 32)
-                if col_num in [7, 12, 14, 15, 16, 18, 19, 20, 22, 23, 24, 26, 27, 28, 30, 31, 32]:
-                    cell.number_format = '#,##0.00'
-            
-            row_num += 1
-        
-        # =====================================================================
-        # AJUSTAR ANCHOS DE COLUMNAS
-        # =====================================================================
-        
-        column_widths = {
-            'A': 12,  # ID Subasta
-            'B': 25,  # Empresa
-            'C': 35,  # Semana (Aumentado para mostrar "Semana X | dd/mm/yyyy...")
-            'D': 12,  # Día
-            'E': 18,  # Fecha Producción
-            'F': 20,  # Tipo Fruta
-            'G': 12,  # Kilos
-            'H': 15,  # Estado
-            'I': 18,  # Fecha Inicio
-            'J': 18,  # Fecha Fin
-            'K': 12,  # Duración
-            'L': 14,  # Precio Base
-            'M': 28,  # Cliente Rank 1
-            'N': 14,  # Monto Rank 1
-            'O': 16,  # Kg Solicitados 1
-            'P': 16,  # Importe Total 1
-            'Q': 28,  # Cliente Rank 2
-            'R': 14,  # Monto Rank 2
-            'S': 16,  # Kg Solicitados 2
-            'T': 16,  # Importe Total 2
-            'U': 28,  # Cliente Rank 3
-            'V': 14,  # Monto Rank 3
-            'W': 16,  # Kg Solicitados 3
-            'X': 16,  # Importe Total 3
-            'Y': 28,  # Cliente Rank 4
-            'Z': 14,  # Monto Rank 4
-            'AA': 16, # Kg Solicitados 4
-            'AB': 16, # Importe Total 4
-            'AC': 28, # Cliente Rank 5
-            'AD': 14, # Monto Rank 5
-            'AE': 16, # Kg Solicitados 5
-            'AF': 16, # Importe Total 5
-            'AG': 14, # Total Ofertas
-        }
-        
-        for col_letter, width in column_widths.items():
-            ws.column_dimensions[col_letter].width = width
+                # Convertir horarios UTC a zona horaria de Perú
+                fecha_inicio_peru = subasta['fecha_hora_inicio'].astimezone(LIMA_TZ)
+                fecha_fin_peru = subasta['fecha_hora_fin'].astimezone(LIMA_TZ)
+                
+                semana_str = semanas_formateadas.get(subasta['semana_id'])
+                if semana_str is None:
+                    semana_str = semanas_formateadas[subasta['semana_id']] = self._formato_semana(
+                        subasta['semana_inicio'], subasta['semana_fin']
+                    )
+                
+                # Calcular duración de la subasta
+                # (días y segundos enteros del timedelta, sin pasar por float)
+                duracion_delta = subasta['fecha_hora_fin'] - subasta['fecha_hora_inicio']
+                duracion_horas, resto = divmod(duracion_delta.days * 86400 + duracion_delta.seconds, 3600)
+                duracion_minutos = resto // 60
+                duracion_str = f"{duracion_horas}h {duracion_minutos}m"
+                
+                # Datos de la fila
+                row_data = [
+                    subasta['id'],
+                    subasta['empresa'],
+                    semana_str,
+                    _DIA_DISPLAY.get(subasta['dia'], subasta['dia']),
+                    _formato_fecha(subasta['fecha']),
+                    subasta['tipo_fruta'],
+                    subasta['kilos'],
+                    estado_real, # Usamos el estado calculado en tiempo real
+                    _formato_fecha_hora(fecha_inicio_peru),  # Horario de Perú
+                    _formato_fecha_hora(fecha_fin_peru),      # Horario de Perú
+                    duracion_str,  # Nueva columna de duración
+                    subasta['precio_base'],
+                    ranking_clientes[0],  # Cliente Rank 1
+                    ranking_montos[0],    # Monto Rank 1
+                    ranking_kilos[0],     # Kg Solicitados 1
+                    ranking_importes[0],  # Importe Total 1
+                    ranking_clientes[1],  # Cliente Rank 2
+                    ranking_montos[1],    # Monto Rank 2
+                    ranking_kilos[1],     # Kg Solicitados 2
+                    ranking_importes[1],  # Importe Total 2
+                    ranking_clientes[2],  # Cliente Rank 3
+                    ranking_montos[2],    # Monto Rank 3
+                    ranking_kilos[2],     # Kg Solicitados 3
+                    ranking_importes[2],  # Importe Total 3
+                    ranking_clientes[3],  # Cliente Rank 4
+                    ranking_montos[3],    # Monto Rank 4
+                    ranking_kilos[3],     # Kg Solicitados 4
+                    ranking_importes[3],  # Importe Total 4
+                    ranking_clientes[4],  # Cliente Rank 5
+                    ranking_montos[4],    # Monto Rank 5
+                    ranking_kilos[4],     # Kg Solicitados 5
+                    ranking_importes[4],  # Importe Total 5
+                    subasta['total_ofertas']  # Anotado en la consulta
+                ]
+                
+                # Escribir la fila
+                ws.append(_fila(ws, row_data, estilos_datos))
+                
+                row_num += 1
         
         # =====================================================================
         # AGREGAR FILTROS AUTOMÁTICOS
@@ -436,19 +679,11 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         # GENERAR RESPUESTA HTTP CON EL ARCHIVO
         # =====================================================================
         
-        # Crear nombre de archivo con timestamp
-        timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"reporte_subastas_{timestamp}.xlsx"
-        
-        # Preparar la respuesta HTTP
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        # Guardar el workbook en la respuesta
-        wb.save(response)
-        
+        # Guardar el workbook, dejarlo en caché y enviarlo en streaming
+        response = _respuesta_excel(wb, filename, clave_cache)
+        # El navegador puede guardar el archivo pero debe revalidarlo con el ETag
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
         return response
     
     @action(detail=False, methods=['get'])
@@ -462,49 +697,71 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         """
         from django.db.models import Count, Sum, Q, Avg, Max
         
-        # Obtener todos los clientes con sus estadísticas
-        clientes = Cliente.objects.all().order_by('nombre_razon_social')
+        # Obtener tiempo actual para cálculos real-time
+        ahora = timezone.now()
         
-        # Generar el archivo Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Clientes"
+        # Obtener todos los clientes con sus estadísticas en una sola consulta:
+        # cada métrica es un conteo condicional sobre sus ofertas en subastas
+        # NO canceladas, en lugar de varias consultas por cliente.
+        # Se omiten las columnas que el reporte no imprime (hash de contraseña, auditoría)
+        no_cancelada = ~Q(ofertas__subasta__estado='CANCELADA')
+        terminada = Q(ofertas__subasta__fecha_hora_fin__lt=ahora)
+        clientes = Cliente.objects.defer('password', 'fecha_actualizacion').select_related(
+            'creado_por'
+        ).annotate(
+            total_ofertas=Count('ofertas', filter=no_cancelada),
+            participacion=Count('ofertas__subasta', filter=no_cancelada, distinct=True),
+            # Subastas ganadas: Oferta ganadora en subasta que ya terminó
+            ganadas=Count('ofertas', filter=no_cancelada & terminada & Q(ofertas__es_ganadora=True)),
+            finalizadas=Count('ofertas__subasta', filter=no_cancelada & terminada, distinct=True),
+            en_curso=Count(
+                'ofertas__subasta',
+                filter=no_cancelada & Q(
+                    ofertas__subasta__fecha_hora_inicio__lte=ahora,
+                    ofertas__subasta__fecha_hora_fin__gte=ahora,
+                ),
+                distinct=True,
+            ),
+        ).order_by('nombre_razon_social')
+        
+        # Generar el archivo Excel (modo streaming)
+        wb, ws, estilos = _crear_workbook("Reporte de Clientes")
         
         # =====================================================================
-        # ESTILOS
+        # AJUSTAR ANCHOS DE COLUMNAS
         # =====================================================================
+        column_widths = {
+            'A': 15,  # RUC/DNI
+            'B': 18,  # Fecha Registro (MOVIDO)
+            'C': 35,  # Nombre / Razón Social
+            'D': 18,  # Tipo
+            'E': 20,  # Sede
+            'F': 15,  # Estado
+            'G': 25,  # Contacto 1
+            'H': 20,  # Cargo 1
+            'I': 15,  # Teléfono 1
+            'J': 30,  # Email 1
+            'K': 25,  # Contacto 2
+            'L': 20,  # Cargo 2
+            'M': 15,  # Teléfono 2
+            'N': 30,  # Email 2
+            'O': 18,  # Estatus Ficha
+            'P': 14,  # Correo Conf.
+            'Q': 16,  # Participación
+            'R': 16,  # Subastas Ganadas
+            'S': 16,  # Subastas Perdidas
+            'T': 16,  # Subastas en Curso
+            'U': 15,  # Total Ofertas
+            'V': 25,  # Creado Por (NUEVO)
+        }
         
-        # Estilo del título
-        titulo_font = Font(name='Calibri', size=16, bold=True, color='FFFFFF')
-        titulo_fill = PatternFill(start_color='1F4788', end_color='1F4788', fill_type='solid')
-        titulo_alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Estilo del encabezado de columnas
-        header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        # Estilo de las celdas de datos
-        cell_font = Font(name='Calibri', size=10)
-        cell_alignment = Alignment(horizontal='left', vertical='center')
-        cell_border = Border(
-            left=Side(style='thin', color='D3D3D3'),
-            right=Side(style='thin', color='D3D3D3'),
-            top=Side(style='thin', color='D3D3D3'),
-            bottom=Side(style='thin', color='D3D3D3')
-        )
+        _ajustar_dimensiones(ws, column_widths)
         
         # =====================================================================
         # TÍTULO DEL REPORTE
         # =====================================================================
         
-        ws.merge_cells('A1:V1')
-        cell_titulo = ws['A1']
-        cell_titulo.value = "REPORTE DE CLIENTES"
-        cell_titulo.font = titulo_font
-        cell_titulo.fill = titulo_fill
-        cell_titulo.alignment = titulo_alignment
-        ws.row_dimensions[1].height = 30
+        _escribir_titulo(ws, "REPORTE DE CLIENTES", estilos['titulo'], 'V')
         
         # =====================================================================
         # ENCABEZADOS DE COLUMNAS
@@ -535,47 +792,16 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             'Creado Por'
         ]
         
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=2, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = cell_border
-        
-        ws.row_dimensions[2].height = 35
+        ws.append(_fila(ws, headers, estilos['encabezado']))
         
         # =====================================================================
         # DATOS DE CLIENTES
         # =====================================================================
         
-        # Obtener tiempo actual para cálculos real-time
-        ahora = timezone.now()
-        
         row_num = 3
         for cliente in clientes:
-            # Base queryset para ofertas del cliente en subastas NO canceladas
-            ofertas_validas = Oferta.objects.filter(cliente=cliente).exclude(subasta__estado='CANCELADA')
-            
-            # IDs de subastas donde ha participado (activas o finalizadas, NO canceladas)
-            ids_subastas_participadas = ofertas_validas.values_list('subasta_id', flat=True).distinct()
-            subastas_validadas = Subasta.objects.filter(id__in=ids_subastas_participadas).exclude(estado='CANCELADA')
-            
-            # Desglose por tiempo
-            finalizadas_ids = subastas_validadas.filter(fecha_hora_fin__lt=ahora).values_list('id', flat=True)
-            activas_ids = subastas_validadas.filter(fecha_hora_inicio__lte=ahora, fecha_hora_fin__gte=ahora).values_list('id', flat=True)
-            
-            # Subastas ganadas: Oferta ganadora en subasta que ya terminó
-            subastas_ganadas = ofertas_validas.filter(
-                subasta_id__in=finalizadas_ids,
-                es_ganadora=True
-            ).count()
-            
             # Subastas perdidas: Finalizadas donde no ganó
-            subastas_perdidas = len(finalizadas_ids) - subastas_ganadas
-            
-            # Subastas en curso
-            subastas_en_curso = len(activas_ids)
+            subastas_perdidas = cliente.finalizadas - cliente.ganadas
             
             # Métricas monetarias
             # Métricas monetarias REMOVIDAS a petición
@@ -596,11 +822,11 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             # Datos de la fila
             row_data = [
                 cliente.ruc_dni,
-                cliente.fecha_creacion.strftime('%d/%m/%Y'),
+                _formato_fecha(cliente.fecha_creacion),
                 cliente.nombre_razon_social,
-                cliente.get_tipo_display(),
+                _TIPO_CLIENTE_DISPLAY.get(cliente.tipo, cliente.tipo),
                 cliente.sede,
-                cliente.get_estado_display(),
+                _ESTADO_CLIENTE_DISPLAY.get(cliente.estado, cliente.estado),
                 cliente.contacto_1,
                 cliente.cargo_1,
                 cliente.numero_1,
@@ -609,58 +835,21 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
                 cliente.cargo_2 or '',
                 cliente.numero_2 or '',
                 cliente.correo_electronico_2 or '',
-                cliente.get_estatus_ficha_display(),
+                _ESTATUS_FICHA_DISPLAY.get(cliente.estatus_ficha, cliente.estatus_ficha),
                 'Sí' if cliente.confirmacion_correo else 'No',
-                subastas_validadas.count(),  # Participación
-                subastas_ganadas,
+                cliente.participacion,  # Participación
+                cliente.ganadas,
                 subastas_perdidas,
-                subastas_en_curso,
-                ofertas_validas.count(),     # Total Ofertas
+                cliente.en_curso,
+                cliente.total_ofertas,  # Total Ofertas
                 creador
             ]
             
             # Escribir la fila
-            for col_num, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col_num)
-                cell.value = value
-                cell.font = cell_font
-                cell.alignment = cell_alignment
-                cell.border = cell_border
+            ws.append(_fila(ws, row_data, estilos['celda']))
             
             row_num += 1
         
-        # =====================================================================
-        # AJUSTAR ANCHOS DE COLUMNAS
-        # =====================================================================
-        
-        column_widths = {
-            'A': 15,  # RUC/DNI
-            'B': 18,  # Fecha Registro (MOVIDO)
-            'C': 35,  # Nombre / Razón Social
-            'D': 18,  # Tipo
-            'E': 20,  # Sede
-            'F': 15,  # Estado
-            'G': 25,  # Contacto 1
-            'H': 20,  # Cargo 1
-            'I': 15,  # Teléfono 1
-            'J': 30,  # Email 1
-            'K': 25,  # Contacto 2
-            'L': 20,  # Cargo 2
-            'M': 15,  # Teléfono 2
-            'N': 30,  # Email 2
-            'O': 18,  # Estatus Ficha
-            'P': 14,  # Correo Conf.
-            'Q': 16,  # Participación
-            'R': 16,  # Subastas Ganadas
-            'S': 16,  # Subastas Perdidas
-            'T': 16,  # Subastas en Curso
-            'U': 15,  # Total Ofertas
-            'V': 25,  # Creado Por (NUEVO)
-        }
-        
-        for col_letter, width in column_widths.items():
-            ws.column_dimensions[col_letter].width = width
-        
         # =====================================================================
         # AGREGAR FILTROS AUTOMÁTICOS
         # =====================================================================
@@ -675,20 +864,12 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
         # GENERAR RESPUESTA HTTP CON EL ARCHIVO
         # =====================================================================
         
-        # Crear nombre de archivo con timestamp
-        timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
+        # Crear nombre de archivo con timestamp (el mismo instante del reporte)
+        timestamp = ahora.strftime('%Y%m%d_%H%M%S')
         filename = f"reporte_clientes_{timestamp}.xlsx"
         
-        # Preparar la respuesta HTTP
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        # Guardar el workbook en la respuesta
-        wb.save(response)
-        
-        return response
+        # Guardar el workbook y enviarlo en streaming
+        return _respuesta_excel(wb, filename)
 
     @action(detail=False, methods=['get'])
     def packing_excel(self, request):
@@ -709,11 +890,30 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             )
         
         # Queryset base
-        queryset = PackingSemanal.objects.select_related('empresa').prefetch_related(
-            'tipos', 
-            'tipos__tipo_fruta', 
-            'tipos__detalles',
-            'tipos__detalles__subastas'  # PREFETCH CRÍTICO: Evita N+1 en el bucle (plural por ForeignKey)
+        # Solo las columnas que imprime el reporte en cada nivel
+        queryset = PackingSemanal.objects.select_related('empresa').only(
+            'id', 'fecha_inicio_semana', 'fecha_fin_semana', 'estado', 'observaciones', 'empresa__nombre'
+        ).prefetch_related(
+            Prefetch(
+                'tipos',
+                queryset=PackingTipo.objects.select_related('tipo_fruta').only(
+                    'id', 'packing_semanal', 'kg_total', 'tipo_fruta__nombre'
+                )
+            ),
+            Prefetch(
+                'tipos__detalles',
+                queryset=PackingDetalle.objects.only('id', 'packing_tipo', 'dia', 'py')
+            ),
+            # PREFETCH CRÍTICO: todas las subastas de los detalles en una consulta,
+            # ordenadas como PackingDetalle.subasta_activa para resolverla en memoria
+            # y con el estado real ya calculado en SQL (con_estado)
+            Prefetch(
+                'tipos__detalles__subastas',
+                queryset=Subasta.objects.con_estado().only(
+                    'id', 'estado', 'packing_detalle', 'fecha_hora_inicio', 'fecha_hora_fin'
+                ).order_by('-fecha_hora_inicio'),
+                to_attr='subastas_cached'
+            ),
         ).order_by('-fecha_inicio_semana', 'empresa__nombre')
         
         # Filtros de fecha
@@ -731,43 +931,19 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             except ValueError:
                 return Response({'error': 'Formato fecha_fin inválido'}, status=400)
 
-        # Generar Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Packing"
-        
-        # Estilos (Estética Naranja Profesional)
-        titulo_font = Font(name='Calibri', size=16, bold=True, color='FFFFFF')
-        titulo_fill = PatternFill(start_color='E46C0A', end_color='E46C0A', fill_type='solid') # Naranja para Packing
-        titulo_alignment = Alignment(horizontal='center', vertical='center')
-        
-        header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-        header_fill = PatternFill(start_color='ED7D31', end_color='ED7D31', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        cell_font = Font(name='Calibri', size=10)
-        cell_alignment = Alignment(horizontal='left', vertical='center')
-        cell_border = Border(
-            left=Side(style='thin', color='D3D3D3'),
-            right=Side(style='thin', color='D3D3D3'),
-            top=Side(style='thin', color='D3D3D3'),
-            bottom=Side(style='thin', color='D3D3D3')
-        )
+        # Generar Excel (modo streaming, estética naranja profesional)
+        wb, ws, estilos = _crear_workbook("Reporte de Packing")
         
-        # --- DEFINIR COLORES DE ESTADO PARA CELDAS DIARIAS ---
-        fill_finalizada = PatternFill(start_color='DDEBF7', end_color='DDEBF7', fill_type='solid') # Azul claro
-        fill_activa = PatternFill(start_color='E2EFDA', end_color='E2EFDA', fill_type='solid')     # Verde claro
-        fill_programada = PatternFill(start_color='FFF2CC', end_color='FFF2CC', fill_type='solid')  # Amarillo claro
-        fill_cancelada = PatternFill(start_color='FCE4D6', end_color='FCE4D6', fill_type='solid')   # Naranja/Rojo claro
+        # Anchos (en modo write_only deben definirse antes de escribir filas)
+        column_widths = {
+            'A': 25, 'B': 35, 'C': 20, # B aumentado para "Semana X | dd/mm/yyyy..."
+            'D': 10, 'E': 10, 'F': 10, 'G': 10, 'H': 10, 'I': 10,
+            'J': 15, 'K': 15, 'L': 40
+        }
+        _ajustar_dimensiones(ws, column_widths)
         
         # Título
-        ws.merge_cells('A1:L1')
-        cell_titulo = ws['A1']
-        cell_titulo.value = "REPORTE DE PACKING / PRODUCCIÓN"
-        cell_titulo.font = titulo_font
-        cell_titulo.fill = titulo_fill
-        cell_titulo.alignment = titulo_alignment
-        ws.row_dimensions[1].height = 30
+        _escribir_titulo(ws, "REPORTE DE PACKING / PRODUCCIÓN", estilos['titulo_packing'], 'L')
         
         # Encabezados
         headers = [
@@ -776,80 +952,80 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
             'KG Total', 'Estado', 'Observaciones'
         ]
         
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=2, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = cell_border
+        ws.append(_fila(ws, headers, estilos['encabezado_packing']))
         
-        ws.row_dimensions[2].height = 35
+        # Formato numérico para KGs (Columnas D a J)
+        estilos_datos = [estilos['celda']] * 3 + [estilos['celda_numero']] * 7 + [estilos['celda']] * 2
         
         # Datos
         row_num = 3
-        for packing in queryset:
+        # Por bloques, igual que en el reporte de subastas
+        for packing in queryset.iterator(chunk_size=REPORTE_CHUNK_SIZE):
             tipos = packing.tipos.all()
+            # Columnas comunes a todas las filas del packing
+            empresa_nombre = packing.empresa.nombre
+            semana_str = self._formato_semana(packing.fecha_inicio_semana, packing.fecha_fin_semana)
+            observaciones = packing.observaciones or ''
             
             # Si el packing no tiene tipos registrados, mostrar una fila base
             if not tipos:
                 row_data = [
-                    packing.empresa.nombre,
-                    self._formato_semana(packing.fecha_inicio_semana, packing.fecha_fin_semana),
+                    empresa_nombre,
+                    semana_str,
                     'Sin producción registrada',
                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
                     0.0,
-                    packing.get_estado_display(),
-                    packing.observaciones or ''
+                    _ESTADO_PACKING_DISPLAY.get(packing.estado, packing.estado),
+                    observaciones
                 ]
                 
-                for col_num, value in enumerate(row_data, 1):
-                    cell = ws.cell(row=row_num, column=col_num)
-                    cell.value = value
-                    cell.font = cell_font
-                    cell.alignment = cell_alignment
-                    cell.border = cell_border
-                    if 4 <= col_num <= 10:
-                        cell.number_format = '#,##0.00'
+                ws.append(_fila(ws, row_data, estilos_datos))
                 
                 row_num += 1
                 continue
 
             # Si tiene tipos, mostrar cada tipo
             for tipo in tipos:
-                # Obtener kilos por día y los objetos PackingDetalle
-                detalles_queryset = tipo.detalles.all()
-                detalles_dict = {d.dia: d for d in detalles_queryset}
+                # Obtener kilos por día y los objetos PackingDetalle (servidos por el
+                # prefetch; se materializan una vez y el resto del bucle usa esta lista)
+                detalles_tipo = list(tipo.detalles.all())
+                detalles_dict = {d.dia: d for d in detalles_tipo}
+                # Detalle de cada columna Lunes..Sábado (None si ese día no tiene registro)
+                detalles_por_dia = [detalles_dict.get(d_nom) for d_nom in DIAS_SEMANA]
                 
                 # --- CALCULAR ESTADO ESPECÍFICO PARA ESTE TIPO (Optimizado) ---
-                # Ahora usamos la property subasta_activa que retorna la subasta no cancelada
-                subastas_tipo = []
-                for detalle in detalles_queryset:
-                    subasta = detalle.subasta_activa  # Property que retorna subasta no cancelada
-                    if subasta:
-                        subastas_tipo.append(subasta)
+                # Equivalente en memoria de PackingDetalle.subasta_activa:
+                # la subasta no cancelada más reciente (None si solo hay canceladas)
+                subasta_activa_por_detalle = {
+                    detalle.id: next(
+                        (s for s in detalle.subastas_cached if s.estado != 'CANCELADA'), None
+                    )
+                    for detalle in detalles_tipo
+                }
+                subastas_tipo = [s for s in subasta_activa_por_detalle.values() if s]
                 
-                estados_list = [s.estado_calculado for s in subastas_tipo]
+                # Conjunto de estados (anotados en SQL) para consultas de pertenencia O(1)
+                estados = {s.estado_calculado for s in subastas_tipo}
                 
                 if not subastas_tipo:
                     estado_tipo = "PROYECTADO"
                 else:
-                    if 'ACTIVA' in estados_list:
+                    if 'ACTIVA' in estados:
                         estado_tipo = "EN SUBASTA"
-                    elif any(e in ('FINALIZADA', 'CANCELADA') for e in estados_list):
+                    elif estados & ESTADOS_TERMINADOS:
                         # Se considera FINALIZADO si todos los días con producción tienen subastas 
                         # Y todas esas subastas están terminadas (Finalizada o Cancelada)
-                        detalles_con_produccion = [d for d in detalles_queryset if d.py > 0]
-                        detalles_con_subasta = [s.packing_detalle_id for s in subastas_tipo]
+                        detalles_con_produccion = [d for d in detalles_tipo if d.py > 0]
+                        detalles_con_subasta = {s.packing_detalle_id for s in subastas_tipo}
                         
                         todo_cubierto = all(d.id in detalles_con_subasta for d in detalles_con_produccion)
-                        todas_terminadas = all(e in ('FINALIZADA', 'CANCELADA') for e in estados_list)
+                        todas_terminadas = estados <= ESTADOS_TERMINADOS
                         
                         if todo_cubierto and todas_terminadas:
                             estado_tipo = "FINALIZADO"
                         else:
                             estado_tipo = "PARCIAL"
-                    elif 'PROGRAMADA' in estados_list:
+                    elif 'PROGRAMADA' in estados:
                         estado_tipo = "PROGRAMADO"
                     else:
                         estado_tipo = "PROYECTADO"
@@ -857,74 +1033,48 @@ class ReporteSubastasViewSet(viewsets.ViewSet):
                 if packing.estado == 'ANULADO':
                     estado_tipo = "ANULADO"
 
-                # Días de la semana para el mapeo
-                dias_semana = ['LUNES', 'MARTES', 'MIERCOLES', 'JUEVES', 'VIERNES', 'SABADO']
-                
                 row_data = [
-                    packing.empresa.nombre,
-                    self._formato_semana(packing.fecha_inicio_semana, packing.fecha_fin_semana),
+                    empresa_nombre,
+                    semana_str,
                     tipo.tipo_fruta.nombre,
                 ]
                 # Llenar los kilos para cada día
-                for d_nom in dias_semana:
-                    row_data.append(float(detalles_dict.get(d_nom).py) if d_nom in detalles_dict else 0.0)
+                row_data.extend(
+                    detalle_dia.py if detalle_dia else 0 for detalle_dia in detalles_por_dia
+                )
                 
                 # Agregar el resto de campos
                 row_data.extend([
-                    float(tipo.kg_total),
+                    tipo.kg_total,
                     estado_tipo,
-                    packing.observaciones or ''
+                    observaciones
                 ])
                 
-                # Escribir la fila y aplicar color naranja SOLO a canceladas
-                for col_num, value in enumerate(row_data, 1):
-                    cell = ws.cell(row=row_num, column=col_num)
-                    cell.value = value
-                    cell.font = cell_font
-                    cell.alignment = cell_alignment
-                    cell.border = cell_border
-                    
-                    # Formato numérico para KGs (Columnas D a J)
-                    if 4 <= col_num <= 10:
-                        cell.number_format = '#,##0.00'
-                    
-                    # --- APLICAR COLOR NARANJA SOLO SI EL DÍA ESTÁ CANCELADO SIN REACTIVAR ---
-                    # Un día está "cancelado sin reactivar" si:
-                    # - Tiene subastas (hay historial)
-                    # - Pero NO tiene subasta activa (subasta_activa es None)
-                    # Esto significa que solo tiene subastas CANCELADAS
-                    if 4 <= col_num <= 9:
-                        dia_nombre = dias_semana[col_num - 4]
-                        detalle_dia = detalles_dict.get(dia_nombre)
+                # --- APLICAR COLOR NARANJA SOLO SI EL DÍA ESTÁ CANCELADO SIN REACTIVAR ---
+                # Un día está "cancelado sin reactivar" si:
+                # - Tiene subastas (hay historial)
+                # - Pero NO tiene subasta activa (subasta_activa es None)
+                # Esto significa que solo tiene subastas CANCELADAS
+                estilos_fila = list(estilos_datos)
+                for i, detalle_dia in enumerate(detalles_por_dia):
+                    if detalle_dia and row_data[3 + i] > 0:
+                        # subasta_activa es None si solo hay canceladas
+                        subasta_activa = subasta_activa_por_detalle[detalle_dia.id]
+                        tiene_subastas = bool(detalle_dia.subastas_cached)
                         
-                        if detalle_dia and value > 0:
-                            # subasta_activa retorna None si solo hay canceladas
-                            subasta_activa = detalle_dia.subasta_activa
-                            tiene_subastas = detalle_dia.subastas.exists()
-                            
-                            # Marcar naranja si tiene historial de subastas pero ninguna vigente
-                            if tiene_subastas and subasta_activa is None:
-                                cell.fill = fill_cancelada 
+                        # Marcar naranja si tiene historial de subastas pero ninguna vigente
+                        if tiene_subastas and subasta_activa is None:
+                            estilos_fila[3 + i] = estilos['celda_numero_cancelada']
+                
+                # Escribir la fila
+                ws.append(_fila(ws, row_data, estilos_fila))
                 
                 row_num += 1
         
-        # Anchos
-        column_widths = {
-            'A': 25, 'B': 35, 'C': 20, # B aumentado para "Semana X | dd/mm/yyyy..."
-            'D': 10, 'E': 10, 'F': 10, 'G': 10, 'H': 10, 'I': 10,
-            'J': 15, 'K': 15, 'L': 40
-        }
-        for col_letter, width in column_widths.items():
-            ws.column_dimensions[col_letter].width = width
-            
         if row_num > 3:
             ws.auto_filter.ref = f"A2:L{row_num-1}"
             
         timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
         filename = f"reporte_packing_{timestamp}.xlsx"
         
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        wb.save(response)
-        
-        return response
+        return _respuesta_excel(wb, filename)
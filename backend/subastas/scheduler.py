@@ -20,60 +20,83 @@ Flujo:
 
 import asyncio
 import logging
+from datetime import datetime
+from typing import Optional
+
 from asgiref.sync import sync_to_async
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
-# Conjunto de IDs de subastas que ya tienen timer activo (evita duplicados)
-_timers_activos: set = set()
+# Timers activos: subasta_id → asyncio.Event que despierta al timer ante una puja.
+# La clave existe mientras la subasta tenga timer (evita duplicados).
+_timers: dict = {}
+
+# Event loop donde corren los timers (se guarda al inicializarlos). Las vistas y
+# señales síncronas se ejecutan en otros hilos y lo usan para despertar o lanzar
+# timers de forma segura, sin depender de asyncio.get_event_loop().
+_loop = None
 
-# Diccionario global: subasta_id → asyncio.Event para anti-sniping
-_eventos_puja: dict = {}
+# Segundos que el timer espera tras una puja para agrupar las que lleguen en ráfaga
+ESPERA_RAFAGA_PUJAS = 0.05
 
 
 def notificar_puja(subasta_id: int):
     """
     Llamado desde views.py cuando se registra una nueva puja.
-    Evalúa SIEMPRE si aplica la extensión de tiempo (anti-sniping).
     
-    Si hay un timer activo, lo despierta para que recalcule el tiempo.
-    Si no hay timer, ejecuta la verificación directamente.
+    Si hay un timer activo, solo lo despierta: el propio timer evalúa la
+    extensión de tiempo (anti-sniping) en el event loop, fuera del hilo de la
+    petición. Si no hay timer, ejecuta la verificación directamente.
     """
-    # Siempre ejecutar la verificación de anti-sniping (sync)
+    evento = _timers.get(subasta_id)
+    if evento is not None and _loop is not None and _loop.is_running():
+        _loop.call_soon_threadsafe(evento.set)
+        return
+
     extendida = _verificar_y_extender(subasta_id)
     if extendida:
         logger.info(f"⏰ Anti-sniping aplicado para subasta #{subasta_id}")
-    
-    # Además, despertar el timer si existe (para que recalcule el tiempo de fin)
-    evento = _eventos_puja.get(subasta_id)
-    if evento:
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.call_soon_threadsafe(evento.set)
-            else:
-                evento.set()
-        except RuntimeError:
-            evento.set()
-
-
-async def programar_timer_subasta(subasta_id: int):
+
+
+def lanzar_timer_subasta(subasta_id: int) -> bool:
+    """
+    Lanza el timer de una subasta desde código síncrono (p. ej. una señal).
+    Retorna False si aún no hay event loop de timers (tests, comandos de gestión).
+    """
+    if _loop is None or not _loop.is_running():
+        logger.debug(f"No hay event loop activo para programar timer de subasta #{subasta_id}")
+        return False
+
+    asyncio.run_coroutine_threadsafe(programar_timer_subasta(subasta_id), _loop)
+    logger.info(f"⏰ Timer programado para nueva subasta #{subasta_id}")
+    return True
+
+
+async def programar_timer_subasta(subasta_id: int, datos=None):
     """
     Programa los timers exactos para una subasta:
     - Si está PROGRAMADA: duerme hasta fecha_hora_inicio → activa
     - Si está ACTIVA:     espera pujas o fin → finaliza (con anti-sniping)
+    
+    `datos` es la tupla (estado, fecha_hora_inicio, fecha_hora_fin) si el
+    llamador ya la leyó (ver inicializar_timers); si no, se consulta en BD.
     """
-    if subasta_id in _timers_activos:
+    global _loop
+
+    if subasta_id in _timers:
         logger.debug(f"Subasta #{subasta_id} ya tiene timer activo, ignorando.")
         return
 
-    _timers_activos.add(subasta_id)
+    _loop = asyncio.get_running_loop()
+    # Evento para recibir señales de nuevas pujas
+    evento = _timers[subasta_id] = asyncio.Event()
     logger.info(f"⏰ Timer registrado para subasta #{subasta_id}")
 
     try:
         # --- Fase 1: PROGRAMADA → ACTIVA ---
-        datos = await sync_to_async(_get_subasta_data)(subasta_id)
+        if datos is None:
+            datos = await _get_subasta_data(subasta_id)
         if not datos:
             return  # Cancelada o no existe
 
@@ -98,70 +121,86 @@ async def programar_timer_subasta(subasta_id: int):
 
         # --- Fase 2: ACTIVA → FINALIZADA (con anti-sniping) ---
         if estado == 'ACTIVA':
-            # Crear evento para recibir señales de nuevas pujas
-            evento = asyncio.Event()
-            _eventos_puja[subasta_id] = evento
-
-            try:
-                while True:
-                    # Leer el tiempo de fin actualizado desde BD
-                    datos_actuales = await sync_to_async(_get_subasta_data)(subasta_id)
+            fin_actual = None
+            while True:
+                # Leer el tiempo de fin actualizado desde BD (salvo que la
+                # extensión anti-sniping acabe de devolverlo)
+                if fin_actual is None:
+                    datos_actuales = await _get_subasta_data(subasta_id)
                     if not datos_actuales:
                         return  # Cancelada
 
-                    _, _, fin_actual = datos_actuales
-                    ahora = timezone.now()
-                    segundos_fin = (fin_actual - ahora).total_seconds()
+                    estado_actual, _, fin_actual = datos_actuales
+                    if estado_actual != 'ACTIVA':
+                        return  # Editada manualmente: ya no la gestiona este timer
+                ahora = timezone.now()
+                segundos_fin = (fin_actual - ahora).total_seconds()
 
-                    if segundos_fin <= 0:
-                        # Tiempo agotado → finalizar
-                        await sync_to_async(_finalizar_subasta)(subasta_id)
+                if segundos_fin <= 0 and not evento.is_set():
+                    # Tiempo agotado → finalizar (si el fin se movió, volver a esperar)
+                    if await sync_to_async(_finalizar_subasta)(subasta_id):
                         break
+                    fin_actual = None
+                    continue
 
-                    logger.info(
-                        f"⏳ Subasta #{subasta_id}: finalizará en "
-                        f"{segundos_fin:.1f}s (a las {fin_actual.strftime('%H:%M:%S')})"
-                    )
-
-                    try:
-                        # Dormir hasta que se acabe el tiempo O llegue una puja
-                        await asyncio.wait_for(evento.wait(), timeout=segundos_fin)
-                        evento.clear()  # Resetear para la próxima puja
-
-                        # → Llegó una puja: notificar_puja() ya ejecutó _verificar_y_extender()
-                        # Solo necesitamos volver al inicio del loop para leer el nuevo fecha_hora_fin
-                        logger.debug(f"⏰ Subasta #{subasta_id}: puja recibida, recalculando tiempo...")
-
-                    except asyncio.TimeoutError:
-                        # → Se acabó el tiempo sin más pujas → finalizar
-                        await sync_to_async(_finalizar_subasta)(subasta_id)
-                        break
+                logger.info(
+                    f"⏳ Subasta #{subasta_id}: finalizará en "
+                    f"{segundos_fin:.1f}s (a las {fin_actual.strftime('%H:%M:%S')})"
+                )
 
-            finally:
-                _eventos_puja.pop(subasta_id, None)
+                try:
+                    # Dormir hasta que se acabe el tiempo O llegue una puja
+                    await asyncio.wait_for(evento.wait(), timeout=max(segundos_fin, 0))
+                    # Ráfaga de pujas: esperar un instante y absorber las señales
+                    # que lleguen mientras tanto, para releer la BD una sola vez
+                    await asyncio.sleep(ESPERA_RAFAGA_PUJAS)
+                except asyncio.TimeoutError:
+                    # Dar el mismo margen a una puja aceptada justo antes del
+                    # vencimiento cuyo aviso todavía no llegó a este hilo
+                    await asyncio.sleep(ESPERA_RAFAGA_PUJAS)
+
+                if evento.is_set():
+                    evento.clear()  # Resetear para la próxima puja
+
+                    # → Llegó una puja (también si coincidió con el vencimiento):
+                    # evaluar anti-sniping. Si se extendió, ya se conoce el nuevo
+                    # fin; si no, se relee la subasta al volver al inicio del loop
+                    # (pudo cancelarse o editarse mientras tanto)
+                    fin_actual = await sync_to_async(_verificar_y_extender)(subasta_id)
+                    if fin_actual:
+                        logger.info(f"⏰ Anti-sniping aplicado para subasta #{subasta_id}")
+                    logger.debug(f"⏰ Subasta #{subasta_id}: puja recibida, recalculando tiempo...")
+                    continue
+
+                # → Se acabó el tiempo sin más pujas → finalizar. Si el fin en BD
+                # se movió mientras tanto, se relee y se vuelve a esperar
+                if await sync_to_async(_finalizar_subasta)(subasta_id):
+                    break
+                fin_actual = None
 
     except asyncio.CancelledError:
         logger.info(f"Timer de subasta #{subasta_id} cancelado.")
     except Exception as e:
         logger.error(f"❌ Error en timer de subasta #{subasta_id}: {e}", exc_info=True)
     finally:
-        _timers_activos.discard(subasta_id)
-        _eventos_puja.pop(subasta_id, None)
+        _timers.pop(subasta_id, None)
 
 
-def _get_subasta_data(subasta_id: int):
+async def _get_subasta_data(subasta_id: int):
     """
     Obtiene (estado, fecha_hora_inicio, fecha_hora_fin) de la subasta.
     Retorna None si no existe o ya está en estado terminal.
+    
+    Usa el ORM asíncrono y lee solo esas tres columnas: se llama en cada
+    vuelta del timer (inicio y cada puja recibida).
     """
     from .models import Subasta
-    try:
-        s = Subasta.objects.get(pk=subasta_id)
-        if s.estado in ('CANCELADA', 'FINALIZADA'):
-            return None
-        return s.estado, s.fecha_hora_inicio, s.fecha_hora_fin
-    except Subasta.DoesNotExist:
-        return None
+    return await (
+        Subasta.objects.filter(pk=subasta_id)
+        .exclude(estado__in=('CANCELADA', 'FINALIZADA'))
+        .values_list('estado', 'fecha_hora_inicio', 'fecha_hora_fin')
+        .afirst()
+    )
 
 
 def _activar_subasta(subasta_id: int) -> bool:
@@ -176,7 +215,7 @@ def _activar_subasta(subasta_id: int) -> bool:
         # Solo actualizar si sigue PROGRAMADA (no fue cancelada manualmente)
         subasta = Subasta.objects.get(pk=subasta_id, estado='PROGRAMADA')
         subasta.estado = 'ACTIVA'
-        subasta.save(update_fields=['estado', 'fecha_actualizacion'])
+        subasta.save(validate=False, update_fields=['estado', 'fecha_actualizacion'])
         logger.info(f"✅ Subasta #{subasta_id} → ACTIVA")
 
         # Notificar al canal general y al canal específico de la subasta
@@ -189,7 +228,7 @@ def _activar_subasta(subasta_id: int) -> bool:
         return False
 
 
-def _verificar_y_extender(subasta_id: int) -> bool:
+def _verificar_y_extender(subasta_id: int) -> Optional[datetime]:
     """
     Verifica si aplica la extensión de tiempo (anti-sniping) y la ejecuta.
 
@@ -198,40 +237,45 @@ def _verificar_y_extender(subasta_id: int) -> bool:
     2. Quedan menos segundos que el umbral configurado
     3. No se ha alcanzado el máximo de extensiones (0 = ilimitado)
 
-    Retorna True si se extendió el tiempo, False si no aplica.
+    Retorna la nueva fecha_hora_fin si se extendió el tiempo, None si no aplica.
     """
     from .models import Subasta, ConfiguracionSubasta
     from .websocket_service import SubastaWebSocketService
     from datetime import timedelta
+    from django.db.models import F
 
     try:
         config = ConfiguracionSubasta.get()
 
         if not config.antisniping_habilitado:
-            return False
+            return None
 
-        subasta = Subasta.objects.get(pk=subasta_id, estado='ACTIVA')
+        # Todas las condiciones van en el WHERE de un único UPDATE: en el caso
+        # común (no aplica extensión) la puja cuesta una sola consulta, y la BD
+        # evalúa las condiciones sobre la fila al escribirla, sin una ventana
+        # entre leer y actualizar en la que otra puja pueda extender también.
         ahora = timezone.now()
-        segundos_restantes = (subasta.fecha_hora_fin - ahora).total_seconds()
-
-        # Verificar umbral
-        if segundos_restantes >= config.antisniping_umbral_segundos:
-            return False  # Quedan suficientes segundos, no extender
-
-        # Verificar límite de extensiones
-        if (config.antisniping_max_extensiones > 0 and
-                subasta.extensiones_realizadas >= config.antisniping_max_extensiones):
-            logger.info(
-                f"ℹ️ Subasta #{subasta_id}: límite de extensiones alcanzado "
-                f"({subasta.extensiones_realizadas}/{config.antisniping_max_extensiones})"
-            )
-            return False
-
-        # Aplicar extensión
-        nueva_fin = subasta.fecha_hora_fin + timedelta(seconds=config.antisniping_extension_segundos)
-        subasta.fecha_hora_fin = nueva_fin
-        subasta.extensiones_realizadas += 1
-        subasta.save(update_fields=['fecha_hora_fin', 'extensiones_realizadas', 'fecha_actualizacion'])
+        filtros = {
+            'pk': subasta_id,
+            'estado': 'ACTIVA',
+            # Quedan menos segundos que el umbral
+            'fecha_hora_fin__lt': ahora + timedelta(seconds=config.antisniping_umbral_segundos),
+        }
+        # Límite de extensiones (0 = ilimitado)
+        if config.antisniping_max_extensiones > 0:
+            filtros['extensiones_realizadas__lt'] = config.antisniping_max_extensiones
+
+        actualizadas = Subasta.objects.filter(**filtros).update(
+            fecha_hora_fin=F('fecha_hora_fin') + timedelta(seconds=config.antisniping_extension_segundos),
+            extensiones_realizadas=F('extensiones_realizadas') + 1,
+            fecha_actualizacion=ahora,
+        )
+        if not actualizadas:
+            return None  # No aplica: quedan suficientes segundos, límite alcanzado o no está ACTIVA
+
+        # Solo al extender se lee la subasta, para notificar el nuevo fin
+        subasta = Subasta.objects.get(pk=subasta_id)
+        nueva_fin = subasta.fecha_hora_fin
 
         logger.info(
             f"⏰ Subasta #{subasta_id}: extendida +{config.antisniping_extension_segundos}s "
@@ -246,35 +290,44 @@ def _verificar_y_extender(subasta_id: int) -> bool:
             extra_data={'tiempo_extendido': True}
         )
 
-        return True
+        return nueva_fin
 
     except Subasta.DoesNotExist:
-        return False
+        return None
     except Exception as e:
         logger.error(f"❌ Error en _verificar_y_extender para subasta #{subasta_id}: {e}", exc_info=True)
-        return False
+        return None
 
 
-def _finalizar_subasta(subasta_id: int):
+def _finalizar_subasta(subasta_id: int) -> bool:
     """
     Cambia el estado de ACTIVA → FINALIZADA en BD y envía notificación WebSocket.
+    Retorna True si se finalizó, False si ya no está ACTIVA o su fecha_hora_fin
+    en BD todavía no pasó (p. ej. la extendió una puja de último momento).
     """
     from .models import Subasta
     from .websocket_service import SubastaWebSocketService
 
     try:
-        # Solo actualizar si sigue ACTIVA
-        subasta = Subasta.objects.get(pk=subasta_id, estado='ACTIVA')
+        # Solo actualizar si sigue ACTIVA y su fin (releído de la BD) ya pasó
+        subasta = Subasta.objects.get(
+            pk=subasta_id, estado='ACTIVA', fecha_hora_fin__lte=timezone.now()
+        )
         subasta.estado = 'FINALIZADA'
-        subasta.save(update_fields=['estado', 'fecha_actualizacion'])
+        subasta.save(validate=False, update_fields=['estado', 'fecha_actualizacion'])
         logger.info(f"🏁 Subasta #{subasta_id} → FINALIZADA")
 
         # Notificar al canal general y al canal específico
         SubastaWebSocketService.notificar_subasta_finalizada(subasta)
         SubastaWebSocketService.notificar_subasta_actualizada(subasta, cambios=['estado'])
+        return True
 
     except Subasta.DoesNotExist:
-        logger.info(f"ℹ️ Subasta #{subasta_id} ya no está ACTIVA (cancelada o finalizada manualmente).")
+        logger.info(
+            f"ℹ️ Subasta #{subasta_id} no se finaliza: ya no está ACTIVA "
+            f"(cancelada o finalizada manualmente) o su fin fue extendido."
+        )
+        return False
 
 
 async def inicializar_timers():
@@ -283,22 +336,30 @@ async def inicializar_timers():
     que aún están en estado PROGRAMADA o ACTIVA.
     Llamado desde el lifespan handler en asgi.py.
     """
+    global _loop
     from django.db import close_old_connections
+
+    _loop = asyncio.get_running_loop()
     await sync_to_async(close_old_connections)()
 
-    ids_pendientes = await sync_to_async(_get_ids_pendientes)()
+    # Una sola consulta con los datos de todas: cada timer arranca sin releer su subasta
+    pendientes = await sync_to_async(_get_pendientes)()
+    ids_pendientes = [subasta_id for subasta_id, *_ in pendientes]
 
     logger.info(f"🚀 Inicializando timers para {len(ids_pendientes)} subastas pendientes: {ids_pendientes}")
 
-    for subasta_id in ids_pendientes:
-        asyncio.ensure_future(programar_timer_subasta(subasta_id))
+    for subasta_id, *datos in pendientes:
+        asyncio.ensure_future(programar_timer_subasta(subasta_id, datos=tuple(datos)))
 
 
-def _get_ids_pendientes():
-    """Obtiene los IDs de subastas PROGRAMADA o ACTIVA (sync)."""
+def _get_pendientes():
+    """
+    Obtiene (id, estado, fecha_hora_inicio, fecha_hora_fin) de las subastas
+    PROGRAMADA o ACTIVA (sync).
+    """
     from .models import Subasta
     return list(
         Subasta.objects
         .filter(estado__in=['PROGRAMADA', 'ACTIVA'])
-        .values_list('id', flat=True)
+        .values_list('id', 'estado', 'fecha_hora_inicio', 'fecha_hora_fin')
     )
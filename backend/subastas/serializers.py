@@ -8,13 +8,65 @@ Estructura:
 - OfertaSerializer: Para las pujas
 """
 
+from decimal import Decimal
+
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
 from .models import Subasta, Oferta
 from modulo_packing.serializers import PackingImagenSerializer
 
 
+class DecimalLecturaField(serializers.DecimalField):
+    """
+    DecimalField para campos de solo lectura en listados. Los montos que ya
+    vienen de la BD con la escala del campo se devuelven con str(), sin volver
+    a cuantizarlos; cualquier otro valor pasa por la conversión normal de DRF.
+    """
+    
+    def to_representation(self, value):
+        coerce_to_string = getattr(self, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if (isinstance(value, Decimal) and coerce_to_string and not self.localize
+                and value.as_tuple().exponent == -self.decimal_places):
+            return str(value)
+        return super().to_representation(value)
+
+
+def campos_solicitados(request):
+    """Campos pedidos con ?fields=a,b,c, o None si no se restringen."""
+    campos = getattr(request, 'query_params', {}).get('fields')
+    if campos:
+        return {campo.strip() for campo in campos.split(',')}
+    return None
+
+
+def pide_campos(request, *nombres):
+    """
+    Indica si la respuesta incluirá alguno de los campos `nombres`. Las vistas
+    lo usan para omitir las precargas de los campos que no se pidieron.
+    """
+    solicitados = campos_solicitados(request)
+    return solicitados is None or not solicitados.isdisjoint(nombres)
+
+
+class CamposSolicitadosMixin:
+    """
+    Permite pedir solo algunos campos con ?fields=a,b,c (p. ej. precio_actual
+    y tiempo_restante en el polling). Los campos omitidos no se serializan,
+    así que sus get_* (imágenes, ofertas, reemplazo) no llegan a ejecutarse.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        solicitados = campos_solicitados(self.context.get('request'))
+        if solicitados is not None:
+            for nombre in set(self.fields) - solicitados:
+                self.fields.pop(nombre)
+
+
 class OfertaSerializer(serializers.ModelSerializer):
     """Serializer para ofertas/pujas."""
     
@@ -69,18 +121,18 @@ class SubastaListSerializer(serializers.ModelSerializer):
     tipo_fruta_nombre = serializers.CharField(source='tipo_fruta.nombre', read_only=True)
     fecha_produccion = serializers.DateField(source='packing_detalle.fecha', read_only=True)
     dia = serializers.CharField(source='packing_detalle.dia', read_only=True)
-    kilos = serializers.DecimalField(source='kilos_totales', max_digits=10, decimal_places=2, read_only=True)
+    kilos = DecimalLecturaField(source='kilos_totales', max_digits=10, decimal_places=2, read_only=True)
     
     # Estado y tiempo
     estado_actual = serializers.CharField(source='estado_calculado', read_only=True)
-    tiempo_restante = serializers.IntegerField(source='tiempo_restante_segundos', read_only=True)
+    tiempo_restante = serializers.SerializerMethodField()
     
     # Precio
-    precio_actual = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    precio_actual = DecimalLecturaField(max_digits=12, decimal_places=2, read_only=True)
     
     # Ganador actual
     cliente_ganando = serializers.SerializerMethodField()
-    total_ofertas = serializers.SerializerMethodField()
+    total_ofertas = serializers.IntegerField(source='num_ofertas', read_only=True)
     
     # Indicador de si fue reactivada (solo para canceladas)
     fue_reactivada = serializers.SerializerMethodField()
@@ -109,21 +161,15 @@ class SubastaListSerializer(serializers.ModelSerializer):
             'extensiones_realizadas',
         ]
     
+    def get_tiempo_restante(self, obj):
+        """Segundos restantes, con el mismo instante para todo el listado."""
+        return obj.segundos_restantes(self.context.get('ahora'))
+    
     def get_cliente_ganando(self, obj):
         """Obtiene el cliente que va ganando (Optimizado)."""
-        # Intentar usar la lista precargada si existe
-        if hasattr(obj, 'ofertas') and hasattr(obj.ofertas, 'all'):
-             ofertas = list(obj.ofertas.all())
-             if not ofertas:
-                 return None
-             # Buscar oferta ganadora en memoria
-             from .models import Oferta
-             # Ordenar por monto descendente
-             oferta = max(ofertas, key=lambda o: o.monto)
-        else:
-            # Fallback a la query si no está precargado
-            oferta = obj.oferta_ganadora
-            
+        # Sin consulta si la queryset usó SubastaQuerySet.con_ganadora()
+        oferta = obj.oferta_ganadora
+        
         if oferta:
             return {
                 'id': oferta.cliente.id,
@@ -132,10 +178,6 @@ class SubastaListSerializer(serializers.ModelSerializer):
             }
         return None
     
-    def get_total_ofertas(self, obj):
-        """Total de ofertas en la subasta."""
-        return obj.ofertas.count()
-
     def get_fue_reactivada(self, obj):
         """
         Indica si esta subasta cancelada fue reemplazada por otra.
@@ -155,7 +197,7 @@ class SubastaListSerializer(serializers.ModelSerializer):
         ).exists()
 
 
-class SubastaDetailSerializer(serializers.ModelSerializer):
+class SubastaDetailSerializer(CamposSolicitadosMixin, serializers.ModelSerializer):
     """Serializer para detalle de subasta con historial de ofertas."""
     
     # Datos del packing
@@ -164,20 +206,20 @@ class SubastaDetailSerializer(serializers.ModelSerializer):
     fecha_produccion = serializers.DateField(source='packing_detalle.fecha', read_only=True)
     dia = serializers.CharField(source='packing_detalle.dia', read_only=True)
     dia_display = serializers.CharField(source='packing_detalle.get_dia_display', read_only=True)
-    kilos = serializers.DecimalField(source='kilos_totales', max_digits=10, decimal_places=2, read_only=True)
+    kilos = DecimalLecturaField(source='kilos_totales', max_digits=10, decimal_places=2, read_only=True)
     
     # Estado y tiempo
     estado_actual = serializers.CharField(source='estado_calculado', read_only=True)
     tiempo_restante = serializers.IntegerField(source='tiempo_restante_segundos', read_only=True)
     
     # Precio
-    precio_actual = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    precio_actual = DecimalLecturaField(max_digits=12, decimal_places=2, read_only=True)
     
-    # Historial de ofertas (RF-03)
-    ofertas = OfertaSerializer(many=True, read_only=True)
+    # Historial de ofertas (RF-03); el completo se expone en historial_ofertas
+    ofertas = OfertaSerializer(source='ofertas_detalle', many=True, read_only=True)
     
-    # Imágenes (RN-01: Jerarquía de imágenes)
-    imagenes = serializers.SerializerMethodField()
+    # Imágenes (RN-01: Jerarquía de imágenes, resuelta por Subasta.get_imagenes)
+    imagenes = PackingImagenSerializer(source='get_imagenes', many=True, read_only=True)
     
     # Información del packing semanal
     packing_semanal_id = serializers.IntegerField(source='packing_semanal.id', read_only=True)
@@ -218,12 +260,6 @@ class SubastaDetailSerializer(serializers.ModelSerializer):
             'extensiones_realizadas',
         ]
     
-    def get_imagenes(self, obj):
-        """Obtiene las imágenes según la jerarquía RN-01."""
-        imagenes = obj.get_imagenes()
-        request = self.context.get('request')
-        return PackingImagenSerializer(imagenes, many=True, context={'request': request}).data
-    
     def get_semana(self, obj):
         """Información de la semana del packing."""
         ps = obj.packing_semanal
@@ -286,19 +322,6 @@ class SubastaCreateSerializer(serializers.ModelSerializer):
             'precio_base',
         ]
     
-    def validate_packing_detalle(self, value):
-        """RF-01: Solo permitir crear nueva subasta si la anterior fue CANCELADA."""
-        # Verificar si existe alguna subasta que NO esté cancelada
-        # (PROGRAMADA, ACTIVA, o FINALIZADA todas bloquean la creación)
-        subasta_activa = Subasta.objects.filter(
-            packing_detalle=value
-        ).exclude(estado='CANCELADA').exists()
-        
-        if subasta_activa:
-            raise serializers.ValidationError('Ya existe Subasta con este Producción Diaria.')
-        
-        return value
-    
     def validate(self, data):
         """Validaciones adicionales."""
         fecha_inicio = data.get('fecha_hora_inicio')
@@ -316,6 +339,24 @@ class SubastaCreateSerializer(serializers.ModelSerializer):
         #     })
         
         return data
+    
+    def create(self, validated_data):
+        """
+        RF-01: Solo se crea una nueva subasta si la anterior fue CANCELADA.
+        Lo garantiza el índice parcial uniq_subasta_vigente_por_detalle: si ya
+        hay una subasta PROGRAMADA, ACTIVA o FINALIZADA para el detalle, el
+        INSERT falla. Campos y fechas ya se validaron, así que no se repite
+        full_clean().
+        """
+        subasta = Subasta(**validated_data)
+        try:
+            with transaction.atomic():
+                subasta.save(validate=False)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                'packing_detalle': ['Ya existe Subasta con este Producción Diaria.']
+            })
+        return subasta
 
 
 class SubastaUpdateSerializer(serializers.ModelSerializer):
@@ -347,6 +388,17 @@ class SubastaUpdateSerializer(serializers.ModelSerializer):
                 "No se puede modificar una subasta finalizada."
             )
         
+        # RF-01: una cancelada solo se reactiva si no fue reemplazada por otra
+        estado = data.get('estado', instance.estado)
+        if instance.estado == 'CANCELADA' and estado != 'CANCELADA':
+            reemplazada = Subasta.objects.filter(
+                packing_detalle_id=instance.packing_detalle_id
+            ).exclude(estado='CANCELADA').exclude(pk=instance.pk).exists()
+            if reemplazada:
+                raise serializers.ValidationError({
+                    'estado': 'Ya existe Subasta con este Producción Diaria.'
+                })
+        
         return data
 
 
@@ -369,7 +421,7 @@ class SubastaMovilListSerializer(serializers.ModelSerializer):
     tipo = serializers.CharField(source='tipo_fruta.nombre', read_only=True)
     cantidad = serializers.SerializerMethodField()
     precio_base = serializers.DecimalField(max_digits=12, decimal_places=2)
-    precio_actual = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    precio_actual = DecimalLecturaField(max_digits=12, decimal_places=2, read_only=True)
     imagen_url = serializers.SerializerMethodField()  # Primera imagen (compatibilidad)
     imagenes = serializers.SerializerMethodField()  # Array de todas las imágenes
     fecha = serializers.SerializerMethodField()  # Fecha de la subasta en UTC
@@ -427,8 +479,8 @@ class SubastaMovilListSerializer(serializers.ModelSerializer):
     def get_imagen_url(self, obj):
         """URL completa de la imagen principal (primera imagen para compatibilidad)."""
         imagenes = obj.get_imagenes()
-        if imagenes.exists():
-            imagen = imagenes.first()
+        if imagenes:
+            imagen = imagenes[0]
             request = self.context.get('request')
             if request and imagen.imagen:
                 return request.build_absolute_uri(imagen.imagen.url)
@@ -474,7 +526,8 @@ class SubastaMovilListSerializer(serializers.ModelSerializer):
 
     def get_ahora_servidor_ms(self, obj):
         """Timestamp actual del servidor en milisegundos para sincronización móvil."""
-        return int(timezone.now().timestamp() * 1000)
+        ahora = self.context.get('ahora') or timezone.now()
+        return int(ahora.timestamp() * 1000)
 
     def get_estado(self, obj):
         """Estado en minúsculas como espera la app."""
@@ -497,7 +550,11 @@ class SubastaMovilListSerializer(serializers.ModelSerializer):
         if request and hasattr(request, 'user') and request.user:
             cliente = request.user
             if hasattr(cliente, 'id'):
-                mi_puja = obj.ofertas.filter(cliente_id=cliente.id).order_by('-monto').first()
+                # Ofertas precargadas por SubastaQuerySet.con_ofertas_de si existen
+                if hasattr(obj, '_mis_ofertas'):
+                    mi_puja = next(iter(obj._mis_ofertas), None)
+                else:
+                    mi_puja = obj.ofertas.filter(cliente_id=cliente.id).order_by('-monto').first()
                 if mi_puja:
                     return float(mi_puja.monto)
         return None
@@ -515,7 +572,7 @@ class SubastaMovilListSerializer(serializers.ModelSerializer):
         return mi_puja >= float(obj.precio_actual)
 
 
-class SubastaMovilDetailSerializer(serializers.ModelSerializer):
+class SubastaMovilDetailSerializer(CamposSolicitadosMixin, serializers.ModelSerializer):
     """
     Detalle de subasta para la app móvil Android.
     Incluye información de pujas y última puja del usuario.
@@ -525,7 +582,7 @@ class SubastaMovilDetailSerializer(serializers.ModelSerializer):
     tipo = serializers.CharField(source='tipo_fruta.nombre', read_only=True)
     cantidad = serializers.SerializerMethodField()
     precio_base = serializers.DecimalField(max_digits=12, decimal_places=2)
-    precio_actual = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    precio_actual = DecimalLecturaField(max_digits=12, decimal_places=2, read_only=True)
     imagen_url = serializers.SerializerMethodField()  # Primera imagen (compatibilidad)
     imagenes = serializers.SerializerMethodField()  # Array de todas las imágenes
     fecha = serializers.SerializerMethodField()  # Fecha de la subasta en UTC
@@ -581,8 +638,8 @@ class SubastaMovilDetailSerializer(serializers.ModelSerializer):
     def get_imagen_url(self, obj):
         """URL de la primera imagen (compatibilidad)."""
         imagenes = obj.get_imagenes()
-        if imagenes.exists():
-            imagen = imagenes.first()
+        if imagenes:
+            imagen = imagenes[0]
             request = self.context.get('request')
             if request and imagen.imagen:
                 return request.build_absolute_uri(imagen.imagen.url)
@@ -696,7 +753,7 @@ class HistorialPujaSerializer(serializers.ModelSerializer):
     fecha = serializers.DateField(source='subasta.packing_detalle.fecha', read_only=True)
     hora_inicio = serializers.SerializerMethodField()
     hora_fin = serializers.SerializerMethodField()
-    mi_puja = serializers.DecimalField(source='monto', max_digits=12, decimal_places=2, read_only=True)
+    mi_puja = DecimalLecturaField(source='monto', max_digits=12, decimal_places=2, read_only=True)
     precio_ganador = serializers.SerializerMethodField()
     es_ganadora = serializers.BooleanField(read_only=True)
     estado = serializers.SerializerMethodField()
@@ -4,11 +4,14 @@ Signals para el módulo de subastas.
 Al crear una nueva subasta PROGRAMADA, se lanza automáticamente
 un timer exacto (asyncio) que activará/finalizará la subasta
 en el momento preciso sin ningún delay.
+
+Al eliminar una oferta se recalculan la ganadora y el precio vigente
+de su subasta.
 """
 
-import asyncio
 import logging
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 logger = logging.getLogger(__name__)
@@ -23,14 +26,20 @@ def programar_timer_nueva_subasta(sender, instance, created, **kwargs):
     if not created or instance.estado != 'PROGRAMADA':
         return
 
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            from subastas.scheduler import programar_timer_subasta
-            asyncio.ensure_future(programar_timer_subasta(instance.id))
-            logger.info(f"⏰ Timer programado para nueva subasta #{instance.id}")
-        else:
-            logger.debug(f"No hay event loop activo para programar timer de subasta #{instance.id}")
-    except RuntimeError:
-        # No hay event loop (ej: durante tests o comandos de gestión)
-        pass
+    from subastas.scheduler import lanzar_timer_subasta
+
+    # Tras el commit, para que el timer encuentre la subasta al leerla desde
+    # el event loop (la señal suele ejecutarse en el hilo de una vista síncrona)
+    subasta_id = instance.id
+    transaction.on_commit(lambda: lanzar_timer_subasta(subasta_id))
+
+
+@receiver(post_delete, sender='subastas.Oferta')
+def recalcular_ganadora_oferta_eliminada(sender, instance, **kwargs):
+    """
+    Tras eliminar una oferta, la siguiente más alta pasa a ser la ganadora y
+    se recalculan precio_vigente y oferta_lider de la subasta.
+    Se envía también en los borrados en cascada (p. ej. al eliminar un
+    cliente) y en QuerySet.delete(), que no llaman a Oferta.delete().
+    """
+    sender.marcar_ganadoras([instance.subasta_id])
@@ -14,9 +14,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db import transaction
 from django.db.models import F, Count
 from django.utils import timezone
+from django.utils.functional import cached_property
 from usuarios.permissions import RBACPermission, requiere_permiso
 
-from .models import Subasta, Oferta
+from .models import Subasta, Oferta, ConcurrencyError
 from .serializers import (
     SubastaListSerializer,
     SubastaDetailSerializer,
@@ -29,6 +30,7 @@ from .serializers import (
     PujaMovilSerializer,
     HistorialPujaSerializer,
     ConfiguracionSubastaSerializer,
+    pide_campos,
 )
 from .websocket_service import SubastaWebSocketService
 from core.emails import enviar_email_ganador
@@ -95,19 +97,26 @@ class SubastaViewSet(viewsets.ModelViewSet):
         # Esto lanzará el error (y el log DENEGADO) solo si realmente no tiene acceso por ninguna vía
         super().check_permissions(request)
     
+    @cached_property
+    def ahora(self):
+        """Instante de referencia de la petición (filtros, estado y serializer)."""
+        return timezone.now()
+    
     def get_queryset(self):
         """Obtener subastas con filtros."""
-        queryset = Subasta.objects.select_related(
-            'packing_detalle',
-            'packing_detalle__packing_tipo',
-            'packing_detalle__packing_tipo__tipo_fruta',
-            'packing_detalle__packing_tipo__packing_semanal',
-            'packing_detalle__packing_tipo__packing_semanal__empresa',
-        ).prefetch_related('ofertas', 'ofertas__cliente')
+        queryset = Subasta.objects.con_packing()
         
         # Para retrieve y acciones de detalle, no aplicar filtros de exclusión
         # Esto permite ver el detalle de cualquier subasta, incluso canceladas reemplazadas
-        if self.action in ['retrieve', 'historial_ofertas', 'cancelar']:
+        if self.action == 'retrieve':
+            # Solo el detalle serializa el historial de ofertas (acotado); con
+            # ?fields= se omiten las precargas de los campos no pedidos
+            if pide_campos(self.request, 'ofertas'):
+                queryset = queryset.con_ofertas_detalle()
+            if pide_campos(self.request, 'imagenes'):
+                queryset = queryset.con_imagenes()
+            return queryset
+        if self.action in ['historial_ofertas', 'cancelar']:
             return queryset
         
         # Filtro por búsqueda de texto
@@ -168,12 +177,16 @@ class SubastaViewSet(viewsets.ModelViewSet):
         # Filtro para subastas activas (en tiempo real)
         activas = self.request.query_params.get('activas', None)
         if activas and activas.lower() == 'true':
-            ahora = timezone.now()
+            ahora = self.ahora
             queryset = queryset.filter(
                 fecha_hora_inicio__lte=ahora,
                 fecha_hora_fin__gte=ahora
             ).exclude(estado='CANCELADA')
         
+        # En el listado el estado se calcula en SQL (la instancia no se modifica después)
+        if self.action == 'list':
+            queryset = queryset.con_estado(self.ahora).con_total_ofertas().con_ganadora().para_listado()
+        
         return queryset.order_by('-fecha_hora_inicio')
     
     def get_serializer_class(self):
@@ -186,6 +199,12 @@ class SubastaViewSet(viewsets.ModelViewSet):
             return SubastaUpdateSerializer
         return SubastaDetailSerializer
     
+    def get_serializer_context(self):
+        """Un solo instante de referencia para todas las filas de la respuesta."""
+        context = super().get_serializer_context()
+        context['ahora'] = self.ahora
+        return context
+    
     def create(self, request, *args, **kwargs):
         """RF-01: Crear/programar una subasta."""
         serializer = self.get_serializer(data=request.data)
@@ -216,12 +235,16 @@ class SubastaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Contar participantes afectados antes de cancelar
-        total_ofertas = subasta.ofertas.count()
-        participantes = subasta.ofertas.values('cliente').distinct().count()
+        # Contar ofertas y participantes afectados antes de cancelar (una consulta)
+        conteo = subasta.ofertas.aggregate(
+            total=Count('id'),
+            participantes=Count('cliente', distinct=True)
+        )
+        total_ofertas = conteo['total']
+        participantes = conteo['participantes']
         
         subasta.estado = 'CANCELADA'
-        subasta.save()
+        subasta.save(validate=False, update_fields=['estado', 'fecha_actualizacion'])
         
         # Notificar por WebSocket
         SubastaWebSocketService.notificar_subasta_cancelada(
@@ -353,14 +376,11 @@ class SubastaViewSet(viewsets.ModelViewSet):
             estado='PROGRAMADA',
             fecha_hora_inicio__lte=ahora,
             fecha_hora_fin__gte=ahora
-        ).select_related(
-            'packing_detalle__packing_tipo__tipo_fruta',
-            'packing_detalle__packing_tipo__packing_semanal__empresa'
-        )
+        ).con_packing()
         
         for subasta in subastas_activar:
             subasta.estado = 'ACTIVA'
-            subasta.save(update_fields=['estado'])
+            subasta.save(validate=False, update_fields=['estado', 'fecha_actualizacion'])
             # Notificar por WebSocket
             SubastaWebSocketService.notificar_subasta_iniciada(subasta)
             activadas += 1
@@ -368,14 +388,16 @@ class SubastaViewSet(viewsets.ModelViewSet):
         # Subastas que deben pasar a FINALIZADA
         subastas_finalizar = Subasta.objects.filter(
             fecha_hora_fin__lt=ahora
-        ).exclude(estado__in=['FINALIZADA', 'CANCELADA']).select_related(
-            'packing_detalle__packing_tipo__tipo_fruta',
-            'packing_detalle__packing_tipo__packing_semanal__empresa'
-        ).prefetch_related('ofertas__cliente')
+        ).exclude(estado__in=['FINALIZADA', 'CANCELADA']).con_packing().prefetch_related('ofertas__cliente')
+        subastas_finalizar = list(subastas_finalizar)
+        
+        # Fijar la oferta ganadora de todo el lote antes de notificar
+        if subastas_finalizar:
+            Oferta.marcar_ganadoras([subasta.id for subasta in subastas_finalizar])
         
         for subasta in subastas_finalizar:
             subasta.estado = 'FINALIZADA'
-            subasta.save(update_fields=['estado'])
+            subasta.save(validate=False, update_fields=['estado', 'fecha_actualizacion'])
             # Notificar por WebSocket
             SubastaWebSocketService.notificar_subasta_finalizada(subasta)
             
@@ -448,23 +470,33 @@ class OfertaViewSet(viewsets.ModelViewSet):
         subasta = serializer.validated_data['subasta']
         monto = serializer.validated_data['monto']
         
-        # Bloquear la subasta para control de concurrencia (RN-03)
-        subasta = Subasta.objects.select_for_update().get(pk=subasta.pk)
+        # Control de concurrencia (RN-03): el UPDATE condicional decide qué
+        # puja concurrente toma el precio, sin bloquear la fila antes
+        if not subasta.reservar_precio(monto):
+            # El CAS también falla si la subasta terminó o se canceló después
+            # de validar: en ese caso se responde como la validación (400)
+            subasta.refresh_from_db(fields=['precio_vigente', 'estado', 'fecha_hora_inicio', 'fecha_hora_fin'])
+            puede, mensaje = subasta.puede_ofertar(monto)
+            if not subasta.esta_activa:
+                return Response({'monto': [mensaje]}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {
+                    'error': 'Otra puja se registró antes. Verifique el precio actual.',
+                    'precio_actual': str(subasta.precio_actual)
+                },
+                status=status.HTTP_409_CONFLICT
+            )
         
-        # Guardar la oferta anterior para notificar al cliente superado
+        # Oferta que se supera (leída tras tomar el precio) para notificar al cliente
         oferta_anterior = subasta.oferta_ganadora
         cliente_superado = oferta_anterior.cliente if oferta_anterior else None
         
-        # Validar nuevamente después del bloqueo
-        puede, mensaje = subasta.puede_ofertar(monto)
-        if not puede:
-            return Response(
-                {'error': mensaje, 'precio_actual': str(subasta.precio_actual)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         # Crear la oferta
-        oferta = serializer.save()
+        try:
+            oferta = serializer.save(subasta=subasta)
+        except ConcurrencyError as e:
+            transaction.set_rollback(True)
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
 
         # Notificar por WebSocket
         SubastaWebSocketService.notificar_nueva_puja(
@@ -479,6 +511,16 @@ class OfertaViewSet(viewsets.ModelViewSet):
 
         output_serializer = OfertaSerializer(oferta)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED)
+    
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        """RN-03: Si otra operación modificó la oferta primero, responder 409."""
+        try:
+            return super().update(request, *args, **kwargs)
+        except ConcurrencyError as e:
+            # Deshacer también el UPDATE versionado si falló el recálculo de la ganadora
+            transaction.set_rollback(True)
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
 
 
 # =============================================================================
@@ -512,17 +554,30 @@ class SubastaMovilViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = None  # Deshabilitar paginación para app móvil
     
+    @cached_property
+    def ahora(self):
+        """Instante de referencia de la petición (filtros, estado y serializer)."""
+        return timezone.now()
+    
     def get_queryset(self):
         """Obtener subastas disponibles para clientes."""
-        ahora = timezone.now()
+        ahora = self.ahora
         
-        queryset = Subasta.objects.select_related(
-            'packing_detalle',
-            'packing_detalle__packing_tipo',
-            'packing_detalle__packing_tipo__tipo_fruta',
-            'packing_detalle__packing_tipo__packing_semanal',
-            'packing_detalle__packing_tipo__packing_semanal__empresa',
-        ).prefetch_related('ofertas').exclude(estado='CANCELADA')
+        queryset = Subasta.objects.con_packing().exclude(estado='CANCELADA')
+
+        # Solo list y retrieve serializan la imagen del packing; el listado
+        # solo necesita las ofertas del propio cliente
+        if self.action == 'list':
+            queryset = queryset.con_imagenes().con_estado(ahora).con_ofertas_de(
+                self.request.user
+            ).para_listado()
+        elif self.action == 'retrieve':
+            # Con ?fields= solo se precarga lo que usan los campos pedidos
+            if pide_campos(self.request, 'imagen_url', 'imagenes'):
+                queryset = queryset.con_imagenes()
+            # total_pujas cuenta sobre las ofertas precargadas
+            if pide_campos(self.request, 'total_pujas'):
+                queryset = queryset.prefetch_related('ofertas')
         
         # Filtro por estado
         estado = self.request.query_params.get('estado', None)
@@ -547,6 +602,12 @@ class SubastaMovilViewSet(viewsets.ReadOnlyModelViewSet):
             return SubastaMovilListSerializer
         return SubastaMovilDetailSerializer
     
+    def get_serializer_context(self):
+        """Un solo instante de referencia para todas las filas de la respuesta."""
+        context = super().get_serializer_context()
+        context['ahora'] = self.ahora
+        return context
+    
     @action(detail=True, methods=['get'])
     def pujas(self, request, pk=None):
         """
@@ -632,13 +693,6 @@ class PujaMovilViewSet(viewsets.ViewSet):
         
         # Usar transacción para control de concurrencia
         with transaction.atomic():
-            # Bloquear la subasta
-            subasta = Subasta.objects.select_for_update().get(pk=subasta_id)
-            
-            # Guardar oferta anterior para notificar al superado
-            oferta_anterior = subasta.oferta_ganadora
-            cliente_superado = oferta_anterior.cliente if oferta_anterior else None
-            
             # Validar oferta
             puede, mensaje = subasta.puede_ofertar(monto)
             if not puede:
@@ -650,13 +704,44 @@ class PujaMovilViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            # CAS: si otra puja tomó el precio entre la validación y este punto,
+            # el UPDATE condicional no afecta filas
+            if not subasta.reservar_precio(monto):
+                # El CAS también falla si la subasta terminó o se canceló después
+                # de validar: en ese caso se responde como la validación (400)
+                subasta.refresh_from_db(fields=['precio_vigente', 'estado', 'fecha_hora_inicio', 'fecha_hora_fin'])
+                puede, mensaje = subasta.puede_ofertar(monto)
+                if not subasta.esta_activa:
+                    return Response(
+                        {'success': False, 'error': mensaje},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                return Response(
+                    {
+                        'success': False,
+                        'error': f'Otra puja se registró antes. El precio actual es S/ {subasta.precio_actual}'
+                    },
+                    status=status.HTTP_409_CONFLICT
+                )
+            
+            # Oferta que se supera (leída tras tomar el precio) para notificar al superado
+            oferta_anterior = subasta.oferta_ganadora
+            cliente_superado = oferta_anterior.cliente if oferta_anterior else None
+            
             # Crear la oferta
-            oferta = Oferta.objects.create(
-                subasta=subasta,
-                cliente=cliente,
-                monto=monto,
-                kilos_solicitados=kilos_solicitados
-            )
+            try:
+                oferta = Oferta.objects.create(
+                    subasta=subasta,
+                    cliente=cliente,
+                    monto=monto,
+                    kilos_solicitados=kilos_solicitados
+                )
+            except ConcurrencyError as e:
+                transaction.set_rollback(True)
+                return Response(
+                    {'success': False, 'error': str(e)},
+                    status=status.HTTP_409_CONFLICT
+                )
 
             # Notificar por WebSocket
             SubastaWebSocketService.notificar_nueva_puja(